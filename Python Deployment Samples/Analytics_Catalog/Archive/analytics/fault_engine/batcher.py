@@ -0,0 +1,121 @@
+
+# coding: utf-8
+
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class _Slot(object):
+
+    def __init__(self, row, state):
+        self.row = row
+        self.state = state
+        self.enqueued = time.time()
+        self.value = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """Coalesces feature rows from concurrent requests into one predict call.
+
+    submit() queues one row and blocks until its result is ready.  A single
+    collector thread takes the oldest waiting row, keeps collecting until
+    max_batch rows are queued or max_wait seconds have passed since that row
+    arrived, stacks them and calls predict_fn(rows, state) once per distinct
+    state in the batch, where state is what each row was submitted with
+    (the caller's ModelState, so a row is never predicted with models other
+    than the ones its request took).  predict_fn must return one result
+    per row, in row order.
+
+    Only requests that are in flight at the same time can share a batch, so
+    the scoring pool needs at least max_batch threads to fill one.
+    """
+
+    def __init__(self, predict_fn, max_batch=64, max_wait=0.002):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.rows = 0
+        self.batch_sizes = Counter()
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+        self._pending = None
+        self._pid = None
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pending = queue.Queue()
+            thread = threading.Thread(target=self._collect, args=(self._pending,))
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def _collect(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = batch[0].enqueued + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(pending.get(True, max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch):
+        started = time.time()
+        groups = []
+        for slot in batch:
+            for state, slots in groups:
+                if state is slot.state:
+                    slots.append(slot)
+                    break
+            else:
+                groups.append((slot.state, [slot]))
+        for state, slots in groups:
+            try:
+                results = self.predict_fn(np.vstack([slot.row for slot in slots]), state)
+                for slot, value in zip(slots, results):
+                    slot.value = value
+            except Exception as e:
+                for slot in slots:
+                    slot.error = e
+        waits = [started - slot.enqueued for slot in batch]
+        self.batches += 1
+        self.rows += len(batch)
+        self.batch_sizes[len(batch)] += 1
+        self.wait_total += sum(waits)
+        self.wait_max = max(self.wait_max, max(waits))
+        for slot in batch:
+            slot.done.set()
+
+    def submit(self, row, state=None):
+        if self._pid != os.getpid():
+            self._start()
+        slot = _Slot(row, state)
+        self._pending.put(slot)
+        slot.done.wait()
+        if slot.error is not None:
+            raise slot.error
+        return slot.value
+
+    def stats(self):
+        return {'batches': self.batches,
+                'rows': self.rows,
+                'mean_batch_size': float(self.rows) / self.batches if self.batches else 0.0,
+                'batch_sizes': dict(self.batch_sizes),
+                'mean_queue_wait': self.wait_total / self.rows if self.rows else 0.0,
+                'max_queue_wait': self.wait_max}
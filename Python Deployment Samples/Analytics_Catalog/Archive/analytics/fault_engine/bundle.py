@@ -0,0 +1,165 @@
+
+# coding: utf-8
+
+"""Versioned model bundles.
+
+    python -m fault_engine.bundle build 2026.10.1 [MODEL_DIR]
+    python -m fault_engine.bundle list [MODEL_DIR]
+    python -m fault_engine.bundle verify 2026.10.1 [MODEL_DIR]
+    python -m fault_engine.bundle use 2026.10.1 [MODEL_DIR]
+
+A bundle is one forest buffer (see tree_engine.write_buffer) holding both
+compiled boosters, the threshold table and the feature layout the models
+expect.  Its header carries the version, the sha1 of every source file and
+a sha256 over the rest of the header and the arrays.  `build` packs
+MODEL_DIR's pickles and CSV into MODEL_DIR/bundles/<version>.bin and never
+overwrites an existing version.
+`use` verifies a bundle, including that its header names the same
+version, and points MODEL_DIR/bundles/CURRENT at it.  The
+model registry serves the version CURRENT names (or MODEL_VERSION, which
+pins one) and picks up a new CURRENT within its check_interval.  Requests
+already running finish on the models they started with.
+"""
+
+import os
+import re
+import sys
+import time
+
+from .features import FEATURES_OBS, FEATURES_CB, OBS_COLUMNS, CB_COLUMNS, N_FEATURES
+from .thresholds import ThresholdIndex
+from .tree_engine import read_buffer, read_header
+
+
+BUNDLE_DIR = 'bundles'
+BUNDLE_SUFFIX = '.bin'
+CURRENT_FILE = 'CURRENT'
+OBS_MODEL = 'model_obs'
+CB_MODEL = 'model_CB'
+VERSION_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+
+def feature_layout():
+    ## what a bundle's models were trained on; checked against features.py at load
+    return {'features_obs': list(FEATURES_OBS), 'features_cb': list(FEATURES_CB),
+            'obs_columns': [OBS_COLUMNS.start, OBS_COLUMNS.stop],
+            'cb_columns': [CB_COLUMNS.start, CB_COLUMNS.stop], 'n_features': N_FEATURES}
+
+
+def bundle_path(model_dir, version):
+    if not VERSION_PATTERN.match(version):
+        raise ValueError('bad bundle version %r' % version)
+    return os.path.join(model_dir, BUNDLE_DIR, version + BUNDLE_SUFFIX)
+
+
+def versions(model_dir):
+    directory = os.path.join(model_dir, BUNDLE_DIR)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-len(BUNDLE_SUFFIX)] for name in os.listdir(directory) if name.endswith(BUNDLE_SUFFIX))
+
+
+def current_version(model_dir):
+    ## the version bundles/CURRENT names, or None when there is none
+    try:
+        with open(os.path.join(model_dir, BUNDLE_DIR, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+
+def load(path):
+    """(model_obs, model_CB, ThresholdIndex, meta) from a bundle.
+
+    Raises ValueError when the checksum, which covers the whole header as
+    well as the arrays, or the feature layout does not match; the forests
+    are views of the mapped file.
+    """
+    forests, header = read_buffer(path, verify=True)
+    meta = header.get('meta') or {}
+    if meta.get('features') != feature_layout():
+        raise ValueError('%s was built for a different feature layout' % path)
+    return forests[OBS_MODEL], forests[CB_MODEL], ThresholdIndex.from_table(header['thresholds']), meta
+
+
+def build(model_dir, version, obs_file='model_Obstruction', cb_file='model_CB',
+          threshold_file='Threshold_limits_pointmachine.csv'):
+    import pickle
+    from .thresholds import read_table
+    from .tree_engine import export_booster, source_digest, write_buffer
+    path = bundle_path(model_dir, version)
+    if os.path.exists(path):
+        raise ValueError('bundle %s already exists' % version)
+    forests = {}
+    sources = {}
+    for name, file_name in ((OBS_MODEL, obs_file), (CB_MODEL, cb_file)):
+        with open(os.path.join(model_dir, file_name), 'rb') as f:
+            raw = f.read()
+        forests[name] = export_booster(pickle.loads(raw))
+        forests[name].source = sources[file_name] = source_digest(raw)
+    thresholds = read_table(os.path.join(model_dir, threshold_file))
+    sources[threshold_file] = thresholds['source']
+    meta = {'version': version, 'built': int(time.time() * 1000), 'sources': sources,
+            'features': feature_layout()}
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    write_buffer(forests, path, thresholds, meta)
+    return path
+
+
+def set_current(model_dir, version):
+    ## point CURRENT at version in one rename; None removes it
+    current = os.path.join(model_dir, BUNDLE_DIR, CURRENT_FILE)
+    if version is None:
+        if os.path.exists(current):
+            os.remove(current)
+        return
+    with open(current + '.tmp', 'w') as f:
+        f.write(version + '\n')
+    os.rename(current + '.tmp', current)
+
+
+def use(model_dir, version):
+    """Verify a bundle, then point CURRENT at it; returns the previous CURRENT.
+
+    A bundle whose header names another version (e.g. a copied file) is
+    refused before CURRENT changes, since every registry would then fail
+    to load it.
+    """
+    meta = load(bundle_path(model_dir, version))[3]
+    if meta.get('version') != version:
+        raise ValueError('bundle %s says it is version %s' % (version, meta.get('version')))
+    previous = current_version(model_dir)
+    set_current(model_dir, version)
+    return previous
+
+
+def main(argv):
+    if not argv or argv[0] not in ('build', 'list', 'verify', 'use'):
+        raise SystemExit(__doc__)
+    command = argv[0]
+    if command == 'list':
+        model_dir = argv[1] if len(argv) > 1 else '.'
+        current = current_version(model_dir)
+        for version in versions(model_dir):
+            meta = read_header(bundle_path(model_dir, version))[0].get('meta', {})
+            sys.stdout.write('%s %-20s built %s\n' % ('*' if version == current else ' ', version,
+                                                      time.strftime('%Y-%m-%d %H:%M:%S',
+                                                                    time.gmtime(meta.get('built', 0) / 1000.0))))
+        return
+    if len(argv) < 2:
+        raise SystemExit(__doc__)
+    version = argv[1]
+    model_dir = argv[2] if len(argv) > 2 else '.'
+    if command == 'build':
+        sys.stdout.write('%s\n' % build(model_dir, version))
+    elif command == 'verify':
+        load(bundle_path(model_dir, version))
+        sys.stdout.write('%s ok\n' % version)
+    else:
+        use(model_dir, version)
+        sys.stdout.write('CURRENT -> %s\n' % version)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,272 @@
+
+# coding: utf-8
+
+import numpy as np
+
+
+FEATURES_OBS = ['points_captured', 'current_gradient', 'Duration']
+FEATURES_CB = ['tot_max', 'tot_min', 'slope']
+
+## column layout of the arrays returned by operation_features/batch_features
+POINTS_CAPTURED, CURRENT_GRADIENT, DURATION, TOT_MAX, TOT_MIN, SLOPE, PEAK_CURRENT = range(7)
+N_FEATURES = 7
+OBS_COLUMNS = slice(POINTS_CAPTURED, DURATION + 1)
+CB_COLUMNS = slice(TOT_MAX, SLOPE + 1)
+
+
+def index_correlation(VALUE):
+    ## Pearson correlation of VALUE against 0..n-1, same as
+    ## np.corrcoef(VALUE, index.values)[0][1] without building the 2x2 matrix
+    n = VALUE.shape[0]
+    mean_index = (n - 1) / 2.0
+    ss_index = n * (n * n - 1) / 12.0
+    centered = VALUE - VALUE.mean()
+    ss_value = np.dot(centered, centered)
+    cov = np.dot(np.arange(n, dtype=np.float64), centered) - mean_index * centered.sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return cov / np.sqrt(ss_index * ss_value)
+
+
+def count_extrema(VALUE):
+    ## strict local maxima/minima, same as argrelextrema(VALUE, np.greater/np.less)
+    step = np.sign(np.diff(VALUE))
+    turn = step[:-1] - step[1:]
+    return np.count_nonzero(turn == 2), np.count_nonzero(turn == -2)
+
+
+def time_stamps(TIMESTAMP):
+    ## int64 when every stamp is whole, as epoch milliseconds are, else
+    ## float64, so fractional stamps reach the duration without truncation
+    TIMESTAMP = np.asarray(TIMESTAMP)
+    if TIMESTAMP.dtype.kind in 'iu':
+        return TIMESTAMP.astype(np.int64)
+    TIMESTAMP = TIMESTAMP.astype(np.float64)
+    if np.array_equal(TIMESTAMP, np.floor(TIMESTAMP)):
+        return TIMESTAMP.astype(np.int64)
+    return TIMESTAMP
+
+
+def operation_features(TIMESTAMP, VALUE):
+    ## obstruction features, carbon-brush features, then the peak current
+    TIMESTAMP = np.asarray(TIMESTAMP)
+    VALUE = np.asarray(VALUE, dtype=np.float64)
+    features = np.empty(N_FEATURES, dtype=np.float64)
+    gradient = index_correlation(VALUE)
+    features[POINTS_CAPTURED] = VALUE.shape[0]
+    features[CURRENT_GRADIENT] = gradient
+    features[DURATION] = TIMESTAMP.max() - TIMESTAMP.min()
+    features[TOT_MAX], features[TOT_MIN] = count_extrema(VALUE)
+    features[SLOPE] = gradient
+    features[PEAK_CURRENT] = VALUE.max()
+    return features
+
+
+def concatenate_operations(operations):
+    ## list of data.time_series dicts -> flat TIMESTAMP, flat VALUE, offsets
+    lengths = [len(operation['current']) for operation in operations]
+    offsets = np.zeros(len(operations) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    TIMESTAMP = np.concatenate([time_stamps(operation['time_stamp']) for operation in operations])
+    VALUE = np.concatenate([np.asarray(operation['current'], dtype=np.float64)
+                            for operation in operations])
+    return TIMESTAMP, VALUE, offsets
+
+
+def select_operations(TIMESTAMP, VALUE, offsets, indices):
+    ## the operations at indices, as a new flat TIMESTAMP, VALUE, offsets
+    offsets = np.asarray(offsets, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.intp)
+    starts = offsets[indices]
+    lengths = offsets[indices + 1] - starts
+    selected = np.zeros(indices.shape[0] + 1, dtype=np.int64)
+    np.cumsum(lengths, out=selected[1:])
+    samples = np.repeat(starts - selected[:-1], lengths) + np.arange(selected[-1])
+    return np.asarray(TIMESTAMP)[samples], np.asarray(VALUE)[samples], selected
+
+
+def batch_features(TIMESTAMP, VALUE, offsets):
+    """Features of every operation in a ragged batch, one row per operation.
+
+    Operation i is TIMESTAMP/VALUE[offsets[i]:offsets[i + 1]]; offsets need
+    not start at 0, samples outside offsets[0]:offsets[-1] are ignored.  All
+    columns are computed with segment-wise reductions over the flat arrays,
+    so there is no Python loop per operation.  Rows match operation_features
+    up to rounding in the gradient.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    if np.any(lengths < 1):
+        raise ValueError('every operation needs at least one sample')
+    ## rebase onto the samples the offsets cover, so the flat arrays start at 0
+    TIMESTAMP = np.asarray(TIMESTAMP)[offsets[0]:offsets[-1]]
+    VALUE = np.asarray(VALUE, dtype=np.float64)[offsets[0]:offsets[-1]]
+    offsets = offsets - offsets[0]
+    starts = offsets[:-1]
+    features = np.empty((lengths.shape[0], N_FEATURES), dtype=np.float64)
+    if lengths.shape[0] == 0:
+        return features
+
+    ## Pearson correlation against the in-segment sample index
+    n = lengths.astype(np.float64)
+    mean_index = (n - 1) / 2.0
+    ss_index = n * (n * n - 1) / 12.0
+    centered = VALUE - np.repeat(np.add.reduceat(VALUE, starts) / n, lengths)
+    local_index = np.arange(VALUE.shape[0], dtype=np.float64) - np.repeat(starts, lengths)
+    ss_value = np.add.reduceat(centered * centered, starts)
+    cov = np.add.reduceat(local_index * centered, starts) - mean_index * np.add.reduceat(centered, starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gradient = cov / np.sqrt(ss_index * ss_value)
+
+    ## strict extrema over the flat array, ignoring turns that straddle two segments
+    step = np.sign(np.diff(VALUE))
+    turn = np.zeros(VALUE.shape[0])
+    turn[1:-1] = step[:-1] - step[1:]
+    turn[starts] = 0
+    turn[offsets[1:] - 1] = 0
+    maxima = np.concatenate(([0], np.cumsum(turn == 2)))
+    minima = np.concatenate(([0], np.cumsum(turn == -2)))
+
+    features[:, POINTS_CAPTURED] = n
+    features[:, CURRENT_GRADIENT] = gradient
+    features[:, DURATION] = np.maximum.reduceat(TIMESTAMP, starts) - np.minimum.reduceat(TIMESTAMP, starts)
+    features[:, TOT_MAX] = maxima[offsets[1:]] - maxima[starts]
+    features[:, TOT_MIN] = minima[offsets[1:]] - minima[starts]
+    features[:, SLOPE] = gradient
+    features[:, PEAK_CURRENT] = np.maximum.reduceat(VALUE, starts)
+    return features
+
+
+def _sign(delta):
+    return int(delta > 0) - int(delta < 0)
+
+
+class OnlineFeatures(object):
+    """Running features of one operation, fed one sample or one chunk at a time.
+
+    Keeps O(1) state: sample count, time stamp range, Welford-style running
+    mean, variance and co-moment against the sample index for the gradient,
+    the first and last values and steps for strict extrema, and the running
+    peak current.  Accumulators over consecutive chunks of an operation can
+    be combined with merge(), so chunks may be reduced independently.
+
+    features() returns the same layout as operation_features.  Points,
+    duration, extrema and peak current are exactly equal to the batch
+    values; the gradient agrees to within a few ulps, far below the float32
+    resolution the boosters compare features at.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.comoment = 0.0
+        self.min_time = None
+        self.max_time = None
+        self.tot_max = 0
+        self.tot_min = 0
+        self.first_value = None
+        self.first_step = None
+        self.last_value = None
+        self.last_step = None
+        self.peak = -np.inf
+
+    @classmethod
+    def from_arrays(cls, TIMESTAMP, VALUE):
+        ## accumulator for a whole chunk, reduced with NumPy instead of per sample
+        VALUE = np.asarray(VALUE, dtype=np.float64)
+        TIMESTAMP = np.asarray(TIMESTAMP)
+        chunk = cls()
+        n = VALUE.shape[0]
+        if n == 0:
+            return chunk
+        chunk.n = n
+        chunk.mean = float(VALUE.mean())
+        centered = VALUE - chunk.mean
+        chunk.m2 = float(np.dot(centered, centered))
+        chunk.comoment = float(np.dot(np.arange(n, dtype=np.float64) - (n - 1) / 2.0, centered))
+        chunk.min_time = TIMESTAMP.min()
+        chunk.max_time = TIMESTAMP.max()
+        chunk.tot_max, chunk.tot_min = count_extrema(VALUE)
+        chunk.first_value = float(VALUE[0])
+        chunk.last_value = float(VALUE[-1])
+        if n > 1:
+            chunk.first_step = _sign(VALUE[1] - VALUE[0])
+            chunk.last_step = _sign(VALUE[-1] - VALUE[-2])
+        chunk.peak = float(VALUE.max())
+        return chunk
+
+    def update(self, timestamp, value):
+        value = float(value)
+        ## the new sample's index is n and the old index mean is (n - 1) / 2
+        delta_index = (self.n + 1) / 2.0 if self.n else 0.0
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.comoment += delta_index * (value - self.mean)
+        if self.last_value is None:
+            self.first_value = value
+            self.min_time = self.max_time = timestamp
+        else:
+            step = _sign(value - self.last_value)
+            if self.last_step == 1 and step == -1:
+                self.tot_max += 1
+            elif self.last_step == -1 and step == 1:
+                self.tot_min += 1
+            if self.first_step is None:
+                self.first_step = step
+            self.last_step = step
+        self.last_value = value
+        self.min_time = min(self.min_time, timestamp)
+        self.max_time = max(self.max_time, timestamp)
+        self.peak = max(self.peak, value)
+
+    def update_many(self, TIMESTAMP, VALUE):
+        self.merge(OnlineFeatures.from_arrays(TIMESTAMP, VALUE))
+
+    def merge(self, other):
+        """Append other, the accumulator of the samples right after this one's."""
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.__dict__.update(other.__dict__)
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        ## other's indices are shifted by self.n, which moves its index mean
+        ## n / 2 above ours (Chan et al. pairwise update)
+        self.comoment += other.comoment + delta * self.n * other.n / 2.0
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.mean += delta * other.n / n
+        ## extrema at the two samples either side of the seam
+        step = _sign(other.first_value - self.last_value)
+        self.tot_max += other.tot_max + (self.last_step == 1 and step == -1) + \
+            (step == 1 and other.first_step == -1)
+        self.tot_min += other.tot_min + (self.last_step == -1 and step == 1) + \
+            (step == -1 and other.first_step == 1)
+        if self.first_step is None:
+            self.first_step = step
+        self.last_step = other.last_step if other.n > 1 else step
+        self.last_value = other.last_value
+        self.n = n
+        self.min_time = min(self.min_time, other.min_time)
+        self.max_time = max(self.max_time, other.max_time)
+        self.peak = max(self.peak, other.peak)
+        return self
+
+    def gradient(self):
+        ss_index = self.n * (self.n * self.n - 1) / 12.0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.float64(self.comoment) / np.sqrt(ss_index * self.m2)
+
+    def features(self):
+        features = np.empty(N_FEATURES, dtype=np.float64)
+        gradient = self.gradient()
+        features[POINTS_CAPTURED] = self.n
+        features[CURRENT_GRADIENT] = gradient
+        features[DURATION] = self.max_time - self.min_time
+        features[TOT_MAX] = self.tot_max
+        features[TOT_MIN] = self.tot_min
+        features[SLOPE] = gradient
+        features[PEAK_CURRENT] = self.peak
+        return features
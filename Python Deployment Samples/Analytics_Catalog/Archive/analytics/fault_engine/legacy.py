@@ -1,13 +1,15 @@
-
 # coding: utf-8
 
+## The original per-operation pandas feature code.  Scoring uses the
+## vectorised features module; these stay as the reference implementation
+## and for benchmark.py.
+
 import pandas as pd
 import numpy as np
-import pickle
-import xgboost as xgb
 from scipy.signal import argrelextrema
+from .thresholds import ThresholdIndex, detect_peak
+
 
-    
 def create_features_obs(df_inst):
     
     df_inst = df_inst   
@@ -64,53 +66,11 @@ def create_newstring(TIMESTAMP,VALUE,PM_Code):
         return operation_2
 
     
-def create_features_pc(TIMESTAMP,VALUE,PM_Code,data):
-    TIMESTAMP = TIMESTAMP
-    VALUE = VALUE
-    PM_Code = PM_Code
-    cutoff=data[data['PointMachineCode']== PM_Code]['Cutoff'].unique()[0]
-    max_current = max(VALUE)
-    if (max_current >cutoff):
-             return 1
-    else:
-        return 0
-
-
-
-def main_process(data_input):
-    
-    TIMESTAMP = data_input['time_stamp'].values
-    VALUE = data_input['current'].values
-    PM_Code = data_input['pointMachineCode'].unique()[0]
-    model_obs = pickle.load(open("model_Obstruction", "rb"))
-    model_CB = pickle.load(open("model_CB", "rb"))
-    data=pd.read_csv("Threshold_limits_pointmachine.csv")
-    operation_1 = create_newstring(TIMESTAMP,VALUE,PM_Code)
-    all_features_obs = create_features_obs(operation_1)
-    all_features_cb = create_features_cb(operation_1)
-    d_test_obs = xgb.DMatrix(all_features_obs)
-    d_test_cb = xgb.DMatrix(all_features_cb)
-    prediction_obs = ((model_obs.predict(d_test_obs))[0]).astype('int')     
-    #prediction_cb = ((model_CB.predict(d_test_cb))).item()
-    prediction_cb =((model_CB.predict(d_test_cb))[0]).astype('int')   
-    prediction_pk = create_features_pc(TIMESTAMP,VALUE,PM_Code,data)
- 
-    
-    if( (prediction_obs==0) and (prediction_cb == 0 )and (prediction_pk==0)):
-        prediction = 'Normal Operation'
-    
-    elif((prediction_obs==1) and (prediction_cb == 0 ) and (prediction_pk==0)) :
-        prediction =  'Obstruction Present'
-    
-    elif((prediction_obs==0) and (prediction_cb >=0.5 )and (prediction_pk==0)):
-        prediction =  'Carbon Brush Problem'
-    
-    elif((prediction_obs==0) and (prediction_cb == 0 )and (prediction_pk==1)) :
-        prediction =  'Peak Current Present'
-    else:
-        prediction='More than one fault'
-    
-    return prediction
-    
-
-
+def create_features_pc(TIMESTAMP,VALUE,PM_Code,thresholds,STATION=None):
+    ## 1/0 for peak current present/absent, PEAK_UNKNOWN if PM_Code has no cutoff;
+    ## thresholds is a ThresholdIndex, or the threshold DataFrame as it used to be
+    if isinstance(thresholds,pd.DataFrame):
+        thresholds = ThresholdIndex.from_frame(thresholds)
+    cutoff = thresholds.cutoff(PM_Code,STATION)
+    max_current = np.max(VALUE)
+    return int(detect_peak(max_current,cutoff))
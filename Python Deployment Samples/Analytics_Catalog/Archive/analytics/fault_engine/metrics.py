@@ -0,0 +1,205 @@
+
+# coding: utf-8
+
+"""Request path metrics in Prometheus text format, and a sampling profiler.
+
+Metrics live in the process that records them; behind gunicorn every
+worker has its own, and each scrape of /metrics reads whichever worker
+answered.
+"""
+
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else '%d' % value
+
+
+class Counter(object):
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *values):
+        with self._lock:
+            self._values[values] += amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, count in items:
+            yield self.name, _format_labels(self.labels, values), count
+
+
+class Gauge(object):
+    ## value read from fn() at scrape time
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def samples(self):
+        yield self.name, '', self.fn()
+
+
+class Histogram(object):
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((values, (list(counts), total)) for values, (counts, total) in self._series.items())
+        for values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="%s"' % ('+Inf' if bound == float('inf') else repr(bound))
+                yield self.name + '_bucket', _format_labels(self.labels, values, le), cumulative
+            yield self.name + '_sum', _format_labels(self.labels, values), total
+            yield self.name + '_count', _format_labels(self.labels, values), cumulative
+
+
+def _max_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+stage_seconds = Histogram('pm_stage_seconds', 'Time spent per request path stage.', ['stage'])
+request_seconds = Histogram('pm_request_seconds', 'Request latency per route.', ['route'])
+requests_total = Counter('pm_requests_total', 'Requests per route and status code.', ['route', 'status'])
+labels_total = Counter('pm_labels_total', 'Operations scored per resulting label.', ['label'])
+max_rss = Gauge('pm_process_max_rss_bytes', 'Peak resident set size of this process.', _max_rss_bytes)
+
+REGISTRY = [stage_seconds, request_seconds, requests_total, labels_total, max_rss]
+
+
+@contextmanager
+def stage(name):
+    started = time.time()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.time() - started, name)
+
+
+def count_labels(labels):
+    for label in labels:
+        labels_total.inc(1, label)
+
+
+def render(metrics=None):
+    lines = []
+    for metric in REGISTRY if metrics is None else metrics:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for name, labels, value in metric.samples():
+            lines.append('%s%s %s' % (name, labels, _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler(object):
+    """Samples every thread's stack each `interval` seconds while running.
+
+    report() gives one 'outer;...;inner count' line per distinct stack, the
+    collapsed format flamegraph.pl and speedscope read.  It costs nothing
+    until start() is called.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        self.samples = 0
+        self._stacks.clear()
+
+    def _run(self):
+        own = threading.current_thread().ident
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def report(self):
+        return ''.join('%s %d\n' % (stack, count) for stack, count in self._stacks.most_common())
+
+
+profiler = SamplingProfiler(interval=float(os.getenv('PROFILER_INTERVAL', 0.005)))
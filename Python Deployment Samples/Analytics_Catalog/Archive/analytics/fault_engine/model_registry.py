@@ -0,0 +1,183 @@
+
+# coding: utf-8
+
+import os
+import pickle
+import threading
+import time
+from collections import namedtuple
+
+from . import bundle
+from .thresholds import ThresholdIndex, table_digest
+from .tree_engine import BUFFER_FILE, COMPILED_SUFFIX, attach_buffer, load_forest, read_header, source_digest
+
+
+## mtimes starts with the bundle version (None when serving the loose files)
+## and doubles as the result cache's model version
+ModelState = namedtuple('ModelState', ['model_obs', 'model_CB', 'thresholds', 'mtimes'])
+
+
+class ModelRegistry(object):
+    """Keeps both boosters and the threshold index in memory.
+
+    When a bundle version is selected (version, else bundles/CURRENT, see
+    fault_engine.bundle) everything comes from that one verified file, and
+    changing CURRENT swaps the models in every process.  Otherwise the loose
+    files are loaded on warm_up() or on the first get(), and reloaded when
+    one of their mtimes changes.  With compiled=True a booster is served
+    from a tree_engine export made from the pickle currently on disk, so
+    predict does not go through xgboost: first from the shared forest buffer
+    (model_forests.bin, mapped read-only so all workers share one copy),
+    then from model_*.npz.  The threshold table also comes from the buffer
+    header when it was written from the CSV currently on disk, so neither
+    pandas nor xgboost is imported unless a fallback needs it.  The mtimes
+    are checked at most once every check_interval seconds so the hot path
+    does not stat the disk per call.  load_seconds holds how long each part
+    of the last load took.
+
+    Callers keep the ModelState they got for the whole call, so a swap
+    never changes the models under a running request.  A reload that fails,
+    however it fails, keeps the previous state, leaves the error in
+    load_error and is not retried before the next check_interval.
+    """
+
+    def __init__(self, base_dir='.', obs_file='model_Obstruction', cb_file='model_CB',
+                 threshold_file='Threshold_limits_pointmachine.csv', check_interval=5.0,
+                 compiled=True, buffer_file=BUFFER_FILE, version=None):
+        self.base_dir = base_dir
+        self.obs_file = obs_file
+        self.cb_file = cb_file
+        self.threshold_file = threshold_file
+        self.check_interval = check_interval
+        self.compiled = compiled
+        self.buffer_file = buffer_file
+        self.version = version
+        self.load_error = None
+        self._lock = threading.Lock()
+        self._state = None
+        self._checked = 0.0
+        self.load_seconds = {}
+
+    def paths(self):
+        return [os.path.join(self.base_dir, name)
+                for name in (self.obs_file, self.cb_file, self.threshold_file)]
+
+    def selected_version(self):
+        return self.version or bundle.current_version(self.base_dir)
+
+    def _mtimes(self):
+        version = self.selected_version()
+        if version is not None:
+            paths = [bundle.bundle_path(self.base_dir, version)]
+        else:
+            paths = self.paths()
+            paths += [path + COMPILED_SUFFIX for path in paths[:2]]
+            paths.append(os.path.join(self.base_dir, self.buffer_file))
+        return (version,) + tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in paths)
+
+    def _load_model(self, path, forests):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        forest = forests.get(os.path.basename(path))
+        if forest is not None and forest.source == source_digest(raw):
+            return forest
+        if self.compiled and os.path.exists(path + COMPILED_SUFFIX):
+            forest = load_forest(path + COMPILED_SUFFIX)
+            if forest.source == source_digest(raw):
+                return forest
+        return pickle.loads(raw)
+
+    def _load_thresholds(self, path, table):
+        if table is not None:
+            with open(path, 'rb') as f:
+                if table_digest(f.read()) == table['source']:
+                    return ThresholdIndex.from_table(table)
+        return ThresholdIndex.from_csv(path)
+
+    def _load_bundle(self, version, mtimes):
+        started = time.time()
+        model_obs, model_CB, thresholds, meta = bundle.load(bundle.bundle_path(self.base_dir, version))
+        if meta.get('version') != version:
+            raise ValueError('bundle %s says it is version %s' % (version, meta.get('version')))
+        self.load_seconds = {'bundle': time.time() - started}
+        return ModelState(model_obs, model_CB, thresholds, mtimes)
+
+    def _load(self, mtimes):
+        if mtimes[0] is not None:
+            return self._load_bundle(mtimes[0], mtimes)
+        obs_path, cb_path, threshold_path = self.paths()
+        buffer_path = os.path.join(self.base_dir, self.buffer_file)
+        seconds = {}
+        started = time.time()
+        forests = {}
+        table = None
+        if os.path.exists(buffer_path):
+            table = read_header(buffer_path)[0].get('thresholds')
+            if self.compiled:
+                forests = attach_buffer(buffer_path)
+        seconds['buffer'], started = time.time() - started, time.time()
+        model_obs = self._load_model(obs_path, forests)
+        seconds['model_obs'], started = time.time() - started, time.time()
+        model_CB = self._load_model(cb_path, forests)
+        seconds['model_CB'], started = time.time() - started, time.time()
+        thresholds = self._load_thresholds(threshold_path, table)
+        seconds['thresholds'] = time.time() - started
+        self.load_seconds = seconds
+        return ModelState(model_obs, model_CB, thresholds, mtimes)
+
+    def get(self):
+        state = self._state
+        now = time.time()
+        if state is not None and now - self._checked < self.check_interval:
+            return state
+        with self._lock:
+            mtimes = self._mtimes()
+            if self._state is None or self._state.mtimes != mtimes:
+                try:
+                    self._state = self._load(mtimes)
+                    self.load_error = None
+                except Exception as e:
+                    ## any failure: truncated pickles raise EOFError or
+                    ## UnpicklingError, a bad booster XGBoostError
+                    self.load_error = '%s: %s' % (type(e).__name__, e)
+                    if self._state is None:
+                        raise
+            self._checked = now
+            return self._state
+
+    def warm_up(self):
+        self._checked = 0.0
+        return self.get()
+
+    def use(self, version):
+        """Switch every process to a bundle version, this one right away.
+
+        When this process cannot load it, CURRENT is put back, so other
+        workers and restarts keep serving the previous version.
+        """
+        previous = bundle.use(self.base_dir, version)
+        pinned = self.version
+        if self.version is not None:
+            self.version = version
+        try:
+            state = self.warm_up()
+            if state.mtimes[0] != version:
+                raise ValueError('could not load bundle %s: %s' % (version, self.load_error))
+        except Exception:
+            bundle.set_current(self.base_dir, previous)
+            self.version = pinned
+            raise
+        return state
+
+    def stats(self):
+        state = self._state
+        return {'version': state.mtimes[0] if state is not None else None,
+                'selected': self.selected_version(), 'available': bundle.versions(self.base_dir),
+                'load_seconds': self.load_seconds, 'load_error': self.load_error}
+
+
+## an absolute MODEL_DIR, so a later chdir does not move the models;
+## MODEL_VERSION pins a bundle regardless of bundles/CURRENT
+registry = ModelRegistry(base_dir=os.path.abspath(os.getenv('MODEL_DIR', '.')),
+                         compiled=os.getenv('COMPILED_MODELS', '1') == '1',
+                         version=os.getenv('MODEL_VERSION') or None)
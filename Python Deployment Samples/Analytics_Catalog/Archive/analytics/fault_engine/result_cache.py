@@ -0,0 +1,85 @@
+
+# coding: utf-8
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+## rough per-entry bookkeeping cost on top of key and value bytes
+ENTRY_OVERHEAD = 128
+
+
+def fingerprint(PM_Code, STATION, TIMESTAMP, VALUE):
+    ## sha1 over the point machine, station and the raw sample buffers
+    digest = hashlib.sha1()
+    digest.update(('%s\t%s\n' % (PM_Code, STATION or '')).encode('utf-8'))
+    digest.update(np.ascontiguousarray(TIMESTAMP, dtype='<i8').tobytes())
+    digest.update(np.ascontiguousarray(VALUE, dtype='<f8').tobytes())
+    return digest.digest()
+
+
+class ResultCache(object):
+    """LRU cache of labels keyed by waveform fingerprint.
+
+    Entries expire after ttl seconds and the least recently used ones are
+    evicted once the cache holds more than max_bytes.  Every call passes the
+    current model version (the registry's file mtimes); when it differs from
+    the version the entries were stored under, the cache is emptied, so a
+    new model or threshold file never serves old labels.
+    """
+
+    def __init__(self, max_bytes=8 << 20, ttl=300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self.bytes = 0
+            self._version = version
+
+    def get(self, key, version):
+        if self.max_bytes <= 0:
+            return None
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self.bytes -= entry[2]
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, version):
+        if self.max_bytes <= 0:
+            return
+        size = len(key) + len(value) + ENTRY_OVERHEAD
+        with self._lock:
+            self._check_version(version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._entries[key] = (time.time() + self.ttl, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted[2]
+                self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes}
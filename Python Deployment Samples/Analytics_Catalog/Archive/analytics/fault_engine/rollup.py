@@ -0,0 +1,136 @@
+
+# coding: utf-8
+
+import threading
+import time
+
+import numpy as np
+
+from .labels import CARBON_BRUSH_BIT, LABEL_CODES, LABELS, OBSTRUCTION_BIT, PEAK_BIT, UNKNOWN_CODE
+
+
+COUNTERS = ('operations', 'obstruction', 'carbon_brush', 'peak_current', 'unknown')
+## one row of COUNTERS per label code
+CODE_COUNTS = np.array([(1, code & OBSTRUCTION_BIT, code & CARBON_BRUSH_BIT, code & PEAK_BIT,
+                         code == UNKNOWN_CODE) for code in range(len(LABELS))], dtype=bool).astype(np.int64)
+
+
+def label_counts(label):
+    ## one row of COUNTERS for a label string
+    return CODE_COUNTS[LABEL_CODES[label]]
+
+
+class HealthRollup(object):
+    """Label counts per (STATIONCODE, PointMachineCode) in fixed time buckets.
+
+    Operations fall in bucket time_stamp // bucket_width.  Each key keeps a
+    ring of the last `buckets` buckets, so ingesting an operation and
+    reading a window never touch raw predictions; counts older than the
+    ring are dropped and counted in `late`.  How old is judged per key, from
+    the newest bucket that key has seen.  Operations stamped more than
+    max_ahead milliseconds past the clock are dropped and counted in
+    `future`, so a corrupt time stamp can neither push the ring forward nor
+    become the default end of window().  Every process keeps its own
+    rollup, so with several gunicorn workers each one reports the traffic
+    it served; merge() adds one rollup into another.
+    """
+
+    def __init__(self, bucket_width=3600000, buckets=168, max_ahead=3600000):
+        self.bucket_width = int(bucket_width)
+        self.buckets = int(buckets)
+        self.max_ahead = max_ahead
+        self.latest = None
+        self.late = 0
+        self.future = 0
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def _ring(self, key):
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = self._rings[key] = (np.full(self.buckets, -1, dtype=np.int64),
+                                       np.zeros((self.buckets, len(COUNTERS)), dtype=np.int64))
+        return ring
+
+    def _add(self, key, bucket, counts):
+        ids, totals = self._ring(key)
+        slot = bucket % self.buckets
+        if ids[slot] != bucket:
+            if ids[slot] > bucket or bucket <= ids.max() - self.buckets:
+                self.late += int(counts[0])
+                return
+            ids[slot] = bucket
+            totals[slot] = 0
+        totals[slot] += counts
+        if self.latest is None or bucket > self.latest:
+            self.latest = bucket
+
+    def add_codes(self, codes, stations, timestamps, label_codes):
+        ## one operation per entry; timestamps are the operations' start time
+        ## stamps and label_codes are labels.LABELS indices
+        buckets = np.asarray(timestamps, dtype=np.int64) // self.bucket_width
+        counts = CODE_COUNTS.take(np.asarray(label_codes, dtype=np.intp), axis=0)
+        limit = None
+        if self.max_ahead is not None:
+            limit = (int(time.time() * 1000) + int(self.max_ahead)) // self.bucket_width
+        with self._lock:
+            for code, station, bucket, row in zip(codes, stations, buckets, counts):
+                if limit is not None and bucket > limit:
+                    self.future += int(row[0])
+                    continue
+                self._add((station, code), int(bucket), row)
+
+    def add_many(self, codes, stations, timestamps, labels):
+        self.add_codes(codes, stations, timestamps, [LABEL_CODES[label] for label in labels])
+
+    def add(self, PM_Code, STATION, timestamp, label):
+        self.add_many([PM_Code], [STATION], [timestamp], [label])
+
+    def merge(self, other):
+        if other.bucket_width != self.bucket_width:
+            raise ValueError('bucket widths differ: %d and %d' % (self.bucket_width, other.bucket_width))
+        with self._lock:
+            for key, (ids, totals) in other._rings.items():
+                for bucket, counts in zip(ids, totals):
+                    if bucket >= 0:
+                        self._add(key, int(bucket), counts)
+            self.late += other.late
+            self.future += other.future
+
+    def window(self, buckets=None, end=None):
+        """Counts and rates per key over the `buckets` buckets ending at `end`.
+
+        buckets defaults to the whole ring and end to the latest bucket
+        seen.  Rates are fault counts over operations.
+        """
+        buckets = self.buckets if buckets is None else min(int(buckets), self.buckets)
+        rows = []
+        with self._lock:
+            if self.latest is None:
+                return rows
+            end = self.latest if end is None else int(end)
+            for (station, code), (ids, totals) in sorted(self._rings.items(),
+                                                         key=lambda item: (item[0][0] or '', item[0][1])):
+                current = (ids > end - buckets) & (ids <= end)
+                if current.any():
+                    rows.append(self._row(station, code, totals[current].sum(axis=0)))
+        return rows
+
+    def by_station(self, buckets=None, end=None):
+        stations = {}
+        for row in self.window(buckets, end):
+            counts = stations.setdefault(row['stationCode'], np.zeros(len(COUNTERS), dtype=np.int64))
+            counts += [row[name] for name in COUNTERS]
+        return [self._row(station, None, counts)
+                for station, counts in sorted(stations.items(), key=lambda item: item[0] or '')]
+
+    def _row(self, station, code, counts):
+        row = {'stationCode': station, 'pointMachineCode': code}
+        row.update((name, int(count)) for name, count in zip(COUNTERS, counts))
+        for name in COUNTERS[1:]:
+            row[name + '_rate'] = float(row[name]) / row['operations'] if row['operations'] else 0.0
+        return row
+
+    def stats(self):
+        return {'keys': len(self._rings), 'latest_bucket': self.latest, 'late': self.late, 'future': self.future,
+                'bucket_width': self.bucket_width, 'buckets': self.buckets}
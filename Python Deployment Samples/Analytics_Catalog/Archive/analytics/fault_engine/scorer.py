@@ -0,0 +1,243 @@
+
+# coding: utf-8
+
+import os
+import time
+
+import numpy as np
+
+from .batcher import MicroBatcher
+from .features import (FEATURES_OBS, FEATURES_CB, OBS_COLUMNS, CB_COLUMNS, PEAK_CURRENT,
+                       operation_features, concatenate_operations, select_operations, batch_features,
+                       time_stamps)
+from .labels import LABELS, decode, label_code, label_codes
+from .metrics import stage, count_labels
+from .model_registry import ModelRegistry
+from .result_cache import ResultCache, fingerprint
+from .rollup import HealthRollup
+from .shadow import ShadowScorer
+from .thresholds import detect_peak
+from .tree_engine import CompiledForest
+
+
+def predict_model(model, features, feature_names):
+    ## compiled forests take the matrix as is, boosters need a DMatrix
+    if isinstance(model, CompiledForest):
+        return model.predict(features).astype('int')
+    import xgboost as xgb
+    return model.predict(xgb.DMatrix(features, feature_names=feature_names)).astype('int')
+
+
+def predict_codes(models, all_features, codes, stations=None):
+    ## Scorer.label_codes without the stage metrics, for work off the request path
+    predictions_obs = predict_model(models.model_obs, all_features[:, OBS_COLUMNS], FEATURES_OBS)
+    predictions_cb = predict_model(models.model_CB, all_features[:, CB_COLUMNS], FEATURES_CB)
+    predictions_pk = detect_peak(all_features[:, PEAK_CURRENT], models.thresholds.cutoffs(codes, stations))
+    return label_codes(predictions_obs, predictions_cb, predictions_pk)
+
+
+class Scorer(object):
+    """Labels point-machine operations with the registry's current models.
+
+    One instance per process holds everything the scoring path keeps
+    between calls: the registry, the micro-batcher for single operations
+    (used when batch_window > 0 seconds), the result cache (off when
+    cache_bytes is 0), the fleet health rollup that every freshly scored
+    label is recorded in (cache hits are not counted again) and, once
+    start_shadow() is called, the shadow scorer that every freshly scored
+    operation is handed to after its label is known.
+    """
+
+    def __init__(self, registry, batch_window=0.0, batch_max_rows=64, cache_bytes=8 << 20,
+                 cache_ttl=300.0, rollup_bucket=3600000, rollup_buckets=168, rollup_max_ahead=3600000):
+        self.registry = registry
+        self.batch_window = batch_window
+        self.batcher = MicroBatcher(self.predict_features, max_batch=batch_max_rows, max_wait=batch_window)
+        self.result_cache = ResultCache(max_bytes=cache_bytes, ttl=cache_ttl)
+        self.rollup = HealthRollup(bucket_width=rollup_bucket, buckets=rollup_buckets, max_ahead=rollup_max_ahead)
+        self.shadow = None
+
+    @classmethod
+    def from_env(cls, registry):
+        ## BATCH_WINDOW_MS > 0 coalesces concurrent single-operation calls into
+        ## shared predicts; RESULT_CACHE_BYTES=0 turns the result cache off;
+        ## SHADOW_VERSION and/or SHADOW_MODEL_DIR turn shadow scoring on
+        scorer = cls(registry,
+                     batch_window=float(os.getenv('BATCH_WINDOW_MS', 0)) / 1000.0,
+                     batch_max_rows=int(os.getenv('BATCH_MAX_ROWS', 64)),
+                     cache_bytes=int(os.getenv('RESULT_CACHE_BYTES', 8 << 20)),
+                     cache_ttl=float(os.getenv('RESULT_CACHE_TTL', 300)),
+                     rollup_bucket=int(os.getenv('ROLLUP_BUCKET_MS', 3600000)),
+                     rollup_buckets=int(os.getenv('ROLLUP_BUCKETS', 168)),
+                     rollup_max_ahead=int(os.getenv('ROLLUP_MAX_AHEAD_MS', 3600000)))
+        if os.getenv('SHADOW_VERSION') or os.getenv('SHADOW_MODEL_DIR'):
+            scorer.start_shadow(version=os.getenv('SHADOW_VERSION') or None,
+                                model_dir=os.getenv('SHADOW_MODEL_DIR') or None,
+                                workers=int(os.getenv('SHADOW_WORKERS', 2)),
+                                queue_size=int(os.getenv('SHADOW_QUEUE', 256)))
+        return scorer
+
+    def start_shadow(self, version=None, model_dir=None, workers=2, queue_size=256, warm=False):
+        """Score every freshly scored operation again with another model set.
+
+        version picks a bundle in model_dir (default: the primary registry's
+        MODEL_DIR); the shadow registry loads on warm_up() or its first job,
+        or right here with warm=True, in which case a load error leaves the
+        current shadow running.  A shadow already running is stopped.  Its
+        labels are only compared, never returned, and a full queue drops
+        work rather than holding up the caller.
+        """
+        shadow_registry = ModelRegistry(base_dir=os.path.abspath(model_dir) if model_dir else self.registry.base_dir,
+                                        compiled=self.registry.compiled, version=version)
+        shadow = ShadowScorer(shadow_registry, predict_codes, workers=workers, queue_size=queue_size)
+        if warm:
+            shadow_registry.warm_up()
+        self.stop_shadow()
+        self.shadow = shadow
+        return shadow
+
+    def stop_shadow(self):
+        ## nothing new is submitted; the old shadow finishes its queue and its threads exit
+        shadow, self.shadow = self.shadow, None
+        if shadow is not None:
+            shadow.stop()
+
+    def warm_up(self):
+        ## load models and thresholds before the first request arrives
+        if self.shadow is not None:
+            self.shadow.registry.warm_up()
+        return self.registry.warm_up()
+
+    def stats(self):
+        stats = {'batcher': self.batcher.stats(), 'result_cache': self.result_cache.stats(),
+                 'rollup': self.rollup.stats(), 'models': self.registry.stats()}
+        if self.shadow is not None:
+            stats['shadow'] = self.shadow.stats()
+        return stats
+
+    def predict_features(self, all_features, models=None):
+        ## obstruction and carbon-brush classes for every row of a feature
+        ## matrix, one predict call per model
+        if models is None:
+            models = self.registry.get()
+        predictions_obs = predict_model(models.model_obs, all_features[:, OBS_COLUMNS], FEATURES_OBS)
+        predictions_cb = predict_model(models.model_CB, all_features[:, CB_COLUMNS], FEATURES_CB)
+        return np.column_stack((predictions_obs, predictions_cb))
+
+    def record(self, models, codes, stations, timestamps, labels):
+        ## freshly scored operations only, so retries answered from the result
+        ## cache are not counted twice; operations without a station count
+        ## under the code's station when the threshold table lists only one,
+        ## else under the None station
+        self.rollup.add_many(codes, [station if station is not None else models.thresholds.station_of(code)
+                                     for code, station in zip(codes, stations)], timestamps, labels)
+        count_labels(labels)
+
+    def score(self, TIMESTAMP, VALUE, PM_Code, STATION=None):
+        """Label of one operation; the old init_func."""
+        models = self.registry.get()
+        TIMESTAMP = time_stamps(TIMESTAMP)
+        VALUE = np.asarray(VALUE, dtype=np.float64)
+        if self.result_cache.max_bytes > 0:
+            with stage('cache'):
+                key = fingerprint(PM_Code, STATION, TIMESTAMP, VALUE)
+                prediction = self.result_cache.get(key, models.mtimes)
+            if prediction is not None:
+                return prediction
+        with stage('features'):
+            all_features = operation_features(TIMESTAMP, VALUE)[np.newaxis]
+        started = time.time()
+        with stage('predict'):
+            if self.batch_window > 0:
+                prediction_obs, prediction_cb = self.batcher.submit(all_features[0], models)
+            else:
+                prediction_obs, prediction_cb = self.predict_features(all_features, models)[0]
+        with stage('label'):
+            prediction_pk = int(detect_peak(all_features[0, PEAK_CURRENT],
+                                            models.thresholds.cutoff(PM_Code, STATION)))
+            code = label_code(prediction_obs, prediction_cb, prediction_pk)
+            prediction = LABELS[code]
+        shadow = self.shadow
+        if shadow is not None:
+            shadow.submit(all_features, [PM_Code], [STATION], [code], time.time() - started)
+        if self.result_cache.max_bytes > 0:
+            self.result_cache.put(key, prediction, models.mtimes)
+        self.record(models, [PM_Code], [STATION], TIMESTAMP[:1], [prediction])
+        return prediction
+
+    def score_frame(self, data_input):
+        ## a DataFrame of data.time_series, as the catalog's main_process took it
+        STATION = None
+        if 'stationCode' in data_input:
+            STATION = data_input['stationCode'].unique()[0]
+        return self.score(data_input['time_stamp'].values, data_input['current'].values,
+                          data_input['pointMachineCode'].unique()[0], STATION)
+
+    def score_many(self, operations):
+        ## operations: list of dicts shaped like data.time_series, one per
+        ## operation; an optional stationCode narrows the cutoff lookup
+        if len(operations) == 0:
+            return []
+        TIMESTAMP, VALUE, offsets = concatenate_operations(operations)
+        return self.score_ragged(TIMESTAMP, VALUE, offsets,
+                                 [operation['pointMachineCode'] for operation in operations],
+                                 [operation.get('stationCode') for operation in operations])
+
+    def score_ragged(self, TIMESTAMP, VALUE, offsets, codes, stations=None):
+        ## same as score_many for operations already flattened as in batch_features
+        if len(codes) == 0:
+            return []
+        models = self.registry.get()
+        if stations is None:
+            stations = [None] * len(codes)
+        if self.result_cache.max_bytes <= 0:
+            predictions = decode(self._score_ragged(models, TIMESTAMP, VALUE, offsets, codes, stations))
+            self.record(models, codes, stations, np.asarray(TIMESTAMP)[offsets[:-1]], predictions)
+            return predictions
+        with stage('cache'):
+            keys = [fingerprint(codes[i], stations[i], TIMESTAMP[offsets[i]:offsets[i + 1]],
+                                VALUE[offsets[i]:offsets[i + 1]])
+                    for i in range(len(codes))]
+            predictions = [self.result_cache.get(key, models.mtimes) for key in keys]
+        missing = [i for i, prediction in enumerate(predictions) if prediction is None]
+        if len(missing) == len(codes):
+            labels = decode(self._score_ragged(models, TIMESTAMP, VALUE, offsets, codes, stations))
+        elif missing:
+            labels = decode(self._score_ragged(models, *select_operations(TIMESTAMP, VALUE, offsets, missing),
+                                               codes=[codes[i] for i in missing],
+                                               stations=[stations[i] for i in missing]))
+        else:
+            labels = []
+        for i, label in zip(missing, labels):
+            predictions[i] = label
+            self.result_cache.put(keys[i], label, models.mtimes)
+        if missing:
+            starts = np.asarray(TIMESTAMP)[np.asarray(offsets)[missing]]
+            self.record(models, [codes[i] for i in missing], [stations[i] for i in missing], starts, labels)
+        return predictions
+
+    def _score_ragged(self, models, TIMESTAMP, VALUE, offsets, codes, stations):
+        with stage('features'):
+            all_features = batch_features(TIMESTAMP, VALUE, offsets)
+        started = time.time()
+        predictions = self.label_codes(all_features, codes, stations, models)
+        shadow = self.shadow
+        if shadow is not None:
+            shadow.submit(all_features, codes, stations, predictions, time.time() - started)
+        return predictions
+
+    def label_codes(self, all_features, codes, stations=None, models=None):
+        """uint8 label codes (labels.LABELS indices) for rows laid out like
+        operation_features, one per point machine code."""
+        if models is None:
+            models = self.registry.get()
+        with stage('predict'):
+            predictions = self.predict_features(all_features, models)
+        with stage('label'):
+            cutoffs = models.thresholds.cutoffs(codes, stations)
+            predictions_pk = detect_peak(all_features[:, PEAK_CURRENT], cutoffs)
+            return label_codes(predictions[:, 0], predictions[:, 1], predictions_pk)
+
+    def label_features(self, all_features, codes, stations=None, models=None):
+        ## label_codes materialised as label strings
+        return decode(self.label_codes(all_features, codes, stations, models))
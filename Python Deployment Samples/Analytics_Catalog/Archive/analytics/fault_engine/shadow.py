@@ -0,0 +1,156 @@
+
+# coding: utf-8
+
+import os
+import threading
+import time
+
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .labels import LABELS
+from .metrics import Counter, Histogram, REGISTRY
+
+
+MAX_WORKERS = 8
+MAX_QUEUE = 4096
+
+shadow_seconds = Histogram('pm_shadow_seconds', 'Predict and label time per operation, by model set.',
+                           ['model'])
+shadow_operations = Counter('pm_shadow_operations_total', 'Shadow-scored operations per primary and shadow label.',
+                            ['label', 'shadow_label'])
+shadow_dropped = Counter('pm_shadow_dropped_total', 'Operations not shadow-scored because the queue was full.')
+REGISTRY.extend([shadow_seconds, shadow_operations, shadow_dropped])
+
+
+class ShadowScorer(object):
+    """Scores already-served operations again with a second model set.
+
+    submit() hands over the feature rows, the label codes the caller
+    returned and how long its predict and label took, and returns at once:
+    the job goes on a queue of at most queue_size jobs and is dropped, and
+    counted, when the queue is full.  workers threads take jobs off the
+    queue, score them with predict_codes(registry.get(), ...) and tally,
+    per primary label, how many operations the shadow labelled differently
+    and the per-operation predict+label time of both model sets.  Threads
+    are started on the first submit in each process, so it survives the
+    gunicorn fork, and stop() ends and joins them.
+    """
+
+    def __init__(self, registry, predict_codes, workers=2, queue_size=256):
+        if not 1 <= workers <= MAX_WORKERS:
+            raise ValueError('shadow workers must be between 1 and %d' % MAX_WORKERS)
+        if not 1 <= queue_size <= MAX_QUEUE:
+            raise ValueError('shadow queue size must be between 1 and %d' % MAX_QUEUE)
+        self.registry = registry
+        self.predict_codes = predict_codes
+        self.workers = workers
+        self.queue_size = queue_size
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_error = None
+        ## [primary code, shadow code] operation counts
+        self.confusion = np.zeros((len(LABELS), len(LABELS)), dtype=np.int64)
+        ## per primary code: summed primary and shadow seconds per operation
+        self.primary_seconds = np.zeros(len(LABELS))
+        self.shadow_seconds = np.zeros(len(LABELS))
+        self._lock = threading.Lock()
+        self._jobs = None
+        self._threads = []
+        self._pid = None
+        self._stopped = False
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid() or self._stopped:
+                return
+            self._jobs = queue.Queue(self.queue_size)
+            self._threads = []
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, args=(self._jobs,))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def stop(self):
+        """Finish the queued jobs, then end and join the worker threads."""
+        with self._lock:
+            self._stopped = True
+            if self._pid != os.getpid():
+                return
+            jobs, threads = self._jobs, self._threads
+            self._threads = []
+        for _ in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
+
+    def submit(self, all_features, codes, stations, primary_codes, primary_seconds):
+        if self._pid != os.getpid():
+            self._start()
+        if self._stopped:
+            return
+        self.submitted += len(codes)
+        try:
+            self._jobs.put_nowait((all_features, codes, stations, primary_codes, primary_seconds))
+        except queue.Full:
+            self.dropped += len(codes)
+            shadow_dropped.inc(len(codes))
+
+    def _work(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            all_features, codes, stations, primary_codes, primary_seconds = job
+            try:
+                started = time.time()
+                shadow_codes = self.predict_codes(self.registry.get(), all_features, codes, stations)
+                self._tally(np.asarray(primary_codes, dtype=np.intp), np.asarray(shadow_codes, dtype=np.intp),
+                            primary_seconds, time.time() - started)
+            except Exception as e:
+                self.failed += len(codes)
+                self.last_error = '%s: %s' % (type(e).__name__, e)
+
+    def _tally(self, primary_codes, shadow_codes, primary_seconds, seconds):
+        rows = len(primary_codes)
+        with self._lock:
+            np.add.at(self.confusion, (primary_codes, shadow_codes), 1)
+            np.add.at(self.primary_seconds, primary_codes, primary_seconds / rows)
+            np.add.at(self.shadow_seconds, primary_codes, seconds / rows)
+        for model, elapsed in (('primary', primary_seconds), ('shadow', seconds)):
+            shadow_seconds.observe(elapsed / rows, model)
+        for primary, shadow in zip(primary_codes, shadow_codes):
+            shadow_operations.inc(1, LABELS[primary], LABELS[shadow])
+
+    def stats(self):
+        with self._lock:
+            confusion = self.confusion.copy()
+            primary_seconds = self.primary_seconds.copy()
+            shadow_seconds = self.shadow_seconds.copy()
+        state = self.registry._state
+        labels = {}
+        for code, label in enumerate(LABELS):
+            operations = int(confusion[code].sum())
+            if operations == 0:
+                continue
+            disagreements = operations - int(confusion[code, code])
+            labels[label] = {'operations': operations, 'disagreements': disagreements,
+                             'disagreement_rate': float(disagreements) / operations,
+                             'primary_ms': primary_seconds[code] / operations * 1e3,
+                             'shadow_ms': shadow_seconds[code] / operations * 1e3,
+                             'delta_ms': (shadow_seconds[code] - primary_seconds[code]) / operations * 1e3,
+                             'shadow_labels': dict((LABELS[other], int(count))
+                                                   for other, count in enumerate(confusion[code]) if count)}
+        scored = int(confusion.sum())
+        return {'version': state.mtimes[0] if state is not None else None,
+                'submitted': self.submitted, 'scored': scored, 'dropped': self.dropped, 'failed': self.failed,
+                'queued': self._jobs.qsize() if self._jobs is not None else 0, 'queue_size': self.queue_size,
+                'disagreement_rate': float(scored - np.trace(confusion)) / scored if scored else 0.0,
+                'last_error': self.last_error, 'labels': labels}
@@ -6,8 +6,9 @@ Created on Aug 2017
 """
 
 import pandas as pd
-from analytics.fault_prediction import fault_prediction
+from analytics.fault_engine import scorer
 
+scorer.warm_up()
 
 def mapper(*args, **kwargs):
     # decode args and kwargs
@@ -15,8 +16,7 @@ def mapper(*args, **kwargs):
         data = kwargs.pop('data')
         df = pd.DataFrame(data['time_series'])
         
-        model = fault_prediction()
-        out =  model.main_process(df)
+        out =  scorer.score_frame(df)
         if (out == ' ') :
             out = 'Error in processing, check input'
         return out 
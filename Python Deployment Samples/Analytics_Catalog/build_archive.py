@@ -0,0 +1,84 @@
+
+# coding: utf-8
+
+"""Build step for the catalog analytic.
+
+    python build_archive.py
+
+Copies the service's fault_engine package into Archive/analytics/fault_engine,
+so the analytic carries its own copy of the engine instead of pointing
+outside its root, and writes Archive.zip from Archive/ for upload.  Run it
+after every change to Flask_MicrosService/Microservice_Deployment/fault_engine
+and commit the copy together with the zip.  --check only reports whether
+the copy is out of date and exits 1 if it is.
+"""
+
+import filecmp
+import os
+import shutil
+import sys
+import zipfile
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.normpath(os.path.join(HERE, os.pardir, 'Flask_MicrosService', 'Microservice_Deployment',
+                                      'fault_engine'))
+ARCHIVE = os.path.join(HERE, 'Archive')
+TARGET = os.path.join(ARCHIVE, 'analytics', 'fault_engine')
+ZIP_FILE = os.path.join(HERE, 'Archive.zip')
+
+
+def engine_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.py'))
+
+
+def stale_files():
+    ## files in the copy that differ from, or are missing in, the service package
+    if not os.path.isdir(TARGET) or os.path.islink(TARGET):
+        return engine_files(SOURCE)
+    source, target = engine_files(SOURCE), engine_files(TARGET)
+    changed = [name for name in source
+               if name not in target or not filecmp.cmp(os.path.join(SOURCE, name), os.path.join(TARGET, name),
+                                                        shallow=False)]
+    return sorted(set(changed) | (set(target) - set(source)))
+
+
+def copy_engine():
+    if os.path.islink(TARGET):
+        os.remove(TARGET)
+    elif os.path.isdir(TARGET):
+        shutil.rmtree(TARGET)
+    os.makedirs(TARGET)
+    for name in engine_files(SOURCE):
+        shutil.copy2(os.path.join(SOURCE, name), os.path.join(TARGET, name))
+
+
+def write_zip():
+    with zipfile.ZipFile(ZIP_FILE + '.tmp', 'w', zipfile.ZIP_DEFLATED) as archive:
+        for root, directories, files in os.walk(ARCHIVE):
+            directories[:] = sorted(name for name in directories if name != '__pycache__')
+            for name in sorted(files):
+                if name.endswith(('.pyc', '.pyo')):
+                    continue
+                path = os.path.join(root, name)
+                archive.write(path, os.path.relpath(path, ARCHIVE).replace(os.sep, '/'))
+    if os.path.exists(ZIP_FILE):
+        os.remove(ZIP_FILE)
+    os.rename(ZIP_FILE + '.tmp', ZIP_FILE)
+
+
+def main(argv):
+    if argv == ['--check']:
+        stale = stale_files()
+        if stale:
+            sys.stdout.write('analytics/fault_engine is out of date: %s\n' % ', '.join(stale))
+            raise SystemExit(1)
+        sys.stdout.write('analytics/fault_engine is up to date\n')
+        return
+    copy_engine()
+    write_zip()
+    sys.stdout.write('%s -> %s\n%s -> %s\n' % (SOURCE, TARGET, ARCHIVE, ZIP_FILE))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
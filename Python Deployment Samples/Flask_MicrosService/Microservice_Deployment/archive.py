@@ -0,0 +1,227 @@
+
+# coding: utf-8
+
+"""Append-only columnar store of point-machine operations.
+
+    python archive.py import store/ archive/2017-*.csv
+    python archive.py score store/ > labels.csv
+
+A store is a directory of flat little-endian columns:
+
+    time_stamp.i64   int64 per sample
+    current.f32      float32 per sample
+    ends.i64         int64 per operation, end of its samples (exclusive)
+    code.i32         int32 per operation, index into dictionary.json codes
+    station.i32      int32 per operation, index into dictionary.json
+                     stations, -1 for none
+    operation_id.txt one operationId per line
+    dictionary.json  {"codes": [...], "stations": [...]}
+
+Columns are opened with np.memmap, so the sample arrays are paged in on
+demand rather than read into memory.  Appends write the samples and the
+metadata first and ends.i64 last; the length of ends.i64 is the number of
+committed operations, so readers never see a half written one.
+"""
+
+import io
+import json
+import os
+import sys
+
+import numpy as np
+
+
+COLUMNS = {'time_stamp': ('time_stamp.i64', '<i8'), 'current': ('current.f32', '<f4'),
+           'ends': ('ends.i64', '<i8'), 'code': ('code.i32', '<i4'), 'station': ('station.i32', '<i4')}
+OPERATION_IDS = 'operation_id.txt'
+DICTIONARY = 'dictionary.json'
+
+
+def _memmap(path, dtype, count=None):
+    ## np.memmap refuses empty files
+    itemsize = np.dtype(dtype).itemsize
+    if count is None:
+        count = os.path.getsize(path) // itemsize if os.path.exists(path) else 0
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+class OperationArchive(object):
+    """One store directory, created on first append.
+
+    Readers see the operations committed when the store was opened or last
+    refresh()ed.  Only one process should append at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.refresh()
+
+    def _file(self, column):
+        return os.path.join(self.path, COLUMNS[column][0])
+
+    def refresh(self):
+        dictionary = os.path.join(self.path, DICTIONARY)
+        if os.path.exists(dictionary):
+            with open(dictionary) as f:
+                names = json.load(f)
+        else:
+            names = {'codes': [], 'stations': []}
+        self.code_names = names['codes']
+        self.station_names = names['stations']
+        self.ends = _memmap(self._file('ends'), COLUMNS['ends'][1])
+        samples = int(self.ends[-1]) if len(self.ends) else 0
+        self.TIMESTAMP = _memmap(self._file('time_stamp'), COLUMNS['time_stamp'][1], samples)
+        self.VALUE = _memmap(self._file('current'), COLUMNS['current'][1], samples)
+        self.code_ids = _memmap(self._file('code'), COLUMNS['code'][1], len(self.ends))
+        self.station_ids = _memmap(self._file('station'), COLUMNS['station'][1], len(self.ends))
+        self._operation_ids = None
+
+    def __len__(self):
+        return len(self.ends)
+
+    @property
+    def offsets(self):
+        return np.concatenate(([0], self.ends)).astype(np.int64)
+
+    @property
+    def operation_ids(self):
+        if self._operation_ids is None:
+            path = os.path.join(self.path, OPERATION_IDS)
+            if os.path.exists(path):
+                with io.open(path, encoding='utf-8') as f:
+                    self._operation_ids = f.read().split(u'\n')[:len(self)]
+            else:
+                self._operation_ids = []
+        return self._operation_ids
+
+    def codes(self, indices=None):
+        ids = self.code_ids if indices is None else self.code_ids[indices]
+        return [self.code_names[i] for i in ids]
+
+    def stations(self, indices=None):
+        ids = self.station_ids if indices is None else self.station_ids[indices]
+        return [self.station_names[i] if i >= 0 else None for i in ids]
+
+    def operation(self, i):
+        start = self.ends[i - 1] if i else 0
+        return {'operationId': self.operation_ids[i], 'pointMachineCode': self.code_names[self.code_ids[i]],
+                'stationCode': self.stations([i])[0],
+                'time_stamp': self.TIMESTAMP[start:self.ends[i]].tolist(),
+                'current': self.VALUE[start:self.ends[i]].tolist()}
+
+    def slice(self, start, stop):
+        """Operations start:stop as (TIMESTAMP, VALUE, offsets) for batch_features.
+
+        The sample arrays are memmap views; offsets are rebased to them.
+        """
+        offsets = self.offsets[start:stop + 1]
+        return self.TIMESTAMP[offsets[0]:offsets[-1]], self.VALUE[offsets[0]:offsets[-1]], offsets - offsets[0]
+
+    def select(self, indices):
+        ## operations at indices, in that order, copied out as (TIMESTAMP, VALUE, offsets)
+        from fault_engine.features import select_operations
+        return select_operations(self.TIMESTAMP, self.VALUE, self.offsets, indices)
+
+    def batches(self, batch_size=4096):
+        for start in range(0, len(self), batch_size):
+            stop = min(start + batch_size, len(self))
+            yield (start, stop) + self.slice(start, stop)
+
+    def append(self, TIMESTAMP, VALUE, offsets, codes, stations=None, operation_ids=None):
+        ## ragged operations, laid out as features.batch_features takes them
+        offsets = np.asarray(offsets, dtype=np.int64)
+        k = len(offsets) - 1
+        if stations is None:
+            stations = [None] * k
+        if operation_ids is None:
+            operation_ids = range(len(self), len(self) + k)
+        if len(codes) != k or len(stations) != k or len(operation_ids) != k:
+            raise ValueError('expected %d codes, stations and operation ids' % k)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        code_index = dict((name, i) for i, name in enumerate(self.code_names))
+        station_index = dict((name, i) for i, name in enumerate(self.station_names))
+        for name in codes:
+            if name not in code_index:
+                code_index[name] = len(self.code_names)
+                self.code_names.append(name)
+        for name in stations:
+            if name is not None and name not in station_index:
+                station_index[name] = len(self.station_names)
+                self.station_names.append(name)
+
+        ## drop anything a crashed append left past the committed end
+        base = int(self.ends[-1]) if len(self.ends) else 0
+        self._write('time_stamp', np.asarray(TIMESTAMP)[offsets[0]:offsets[-1]], base)
+        self._write('current', np.asarray(VALUE)[offsets[0]:offsets[-1]], base)
+        self._write('code', [code_index[name] for name in codes], len(self))
+        self._write('station', [-1 if name is None else station_index[name] for name in stations], len(self))
+        ids_path = os.path.join(self.path, OPERATION_IDS)
+        committed = sum(len((u'%s\n' % i).encode('utf-8')) for i in self.operation_ids)
+        with open(ids_path, 'ab') as f:
+            f.truncate(committed)
+            f.write(u''.join(u'%s\n' % i for i in operation_ids).encode('utf-8'))
+        with open(os.path.join(self.path, DICTIONARY + '.tmp'), 'w') as f:
+            json.dump({'codes': self.code_names, 'stations': self.station_names}, f)
+        os.rename(os.path.join(self.path, DICTIONARY + '.tmp'), os.path.join(self.path, DICTIONARY))
+        self._write('ends', offsets[1:] - offsets[0] + base, len(self))
+        self.refresh()
+
+    def _write(self, column, values, committed):
+        name, dtype = COLUMNS[column]
+        with open(os.path.join(self.path, name), 'ab') as f:
+            f.truncate(committed * np.dtype(dtype).itemsize)
+            f.write(np.asarray(values, dtype=dtype).tobytes())
+
+    def score(self, batch_size=4096, label=None):
+        ## (start, stop, labels) per batch; label defaults to scorer.label_features,
+        ## pass scorer.label_codes for uint8 label codes
+        from fault_engine.features import batch_features
+        if label is None:
+            from fault_engine import scorer
+            label = scorer.label_features
+        for start, stop, TIMESTAMP, VALUE, offsets in self.batches(batch_size):
+            yield start, stop, label(batch_features(TIMESTAMP, VALUE, offsets),
+                                     self.codes(slice(start, stop)), self.stations(slice(start, stop)))
+
+    def score_operations(self, indices, batch_size=4096, label=None):
+        ## (indices, labels) per batch of the given operations, e.g. a TimeIndex query
+        from fault_engine.features import batch_features
+        if label is None:
+            from fault_engine import scorer
+            label = scorer.label_features
+        indices = np.asarray(indices, dtype=np.intp)
+        for start in range(0, indices.shape[0], batch_size):
+            batch = indices[start:start + batch_size]
+            yield batch, label(batch_features(*self.select(batch)), self.codes(batch), self.stations(batch))
+
+
+def main(argv):
+    command, path = argv[0], argv[1]
+    archive = OperationArchive(path)
+    if command == 'import':
+        from rescore import input_files, read_operations
+        for name in input_files(argv[2:]):
+            ids, codes, stations, TIMESTAMP, VALUE, offsets = read_operations(name)
+            archive.append(TIMESTAMP, VALUE, offsets, codes, stations, ids)
+            sys.stderr.write('%s: %d operations, %d stored\n' % (name, len(ids), len(archive)))
+    elif command == 'score':
+        from fault_engine import decode, scorer
+        scorer.warm_up()
+        sys.stdout.write('operationId,pointMachineCode,stationCode,value\n')
+        for start, stop, label_codes in archive.score(label=scorer.label_codes):
+            labels = decode(label_codes)
+            codes = archive.codes(slice(start, stop))
+            stations = archive.stations(slice(start, stop))
+            for i, label in enumerate(labels):
+                sys.stdout.write('%s,%s,%s,%s\n' % (archive.operation_ids[start + i], codes[i],
+                                                    stations[i] or '', label))
+    else:
+        raise SystemExit(__doc__)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,173 @@
+
+# coding: utf-8
+
+"""Offline benchmark of the fault-prediction pipeline.
+
+    python benchmark.py
+    python benchmark.py --save benchmark_baseline.json
+    python benchmark.py --compare benchmark_baseline.json --tolerance 0.2
+
+Runs on synthetic.operations with a fixed seed, so runs on the same machine
+are comparable.  Reports ns per operation for each stage, score latency
+percentiles and score_ragged throughput at 1, 64 and 4096 operations per
+call.  The result cache is switched off for the whole run.  --compare exits
+with status 1 when any number is worse than the baseline by more than the
+tolerance.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import synthetic
+
+
+BATCH_SIZES = (1, 64, 4096)
+
+
+def _ns_per_op(fn, ops_per_call=1, min_time=0.2):
+    ## best of three timed runs, each repeating fn for at least min_time
+    calls = 1
+    while True:
+        started = time.time()
+        for _ in range(calls):
+            fn()
+        elapsed = time.time() - started
+        if elapsed >= min_time:
+            break
+        calls *= 2
+    best = elapsed
+    for _ in range(2):
+        started = time.time()
+        for _ in range(calls):
+            fn()
+        best = min(best, time.time() - started)
+    return best / calls / ops_per_call * 1e9
+
+
+def stage_timings(operations, min_time=0.2):
+    from fault_engine import legacy, scorer
+    from fault_engine.features import FEATURES_OBS, FEATURES_CB, OBS_COLUMNS, CB_COLUMNS, batch_features, \
+        concatenate_operations, operation_features
+    from fault_engine.scorer import predict_model
+    models = scorer.registry.get()
+    operation = operations[1]
+    TIMESTAMP = np.asarray(operation['time_stamp'], dtype=np.int64)
+    VALUE = np.asarray(operation['current'], dtype=np.float64)
+    PM_Code = operation['pointMachineCode']
+    frame = legacy.create_newstring(TIMESTAMP, VALUE, PM_Code)
+    batch = concatenate_operations(operations[:4096])
+    k = len(batch[2]) - 1
+    features = batch_features(*batch)
+    row = features[:1]
+    timings = {
+        'create_newstring': lambda: legacy.create_newstring(TIMESTAMP, VALUE, PM_Code),
+        'create_features_obs': lambda: legacy.create_features_obs(frame),
+        'create_features_cb': lambda: legacy.create_features_cb(frame),
+        'create_features_pc': lambda: legacy.create_features_pc(TIMESTAMP, VALUE, PM_Code, models.thresholds),
+        'operation_features': lambda: operation_features(TIMESTAMP, VALUE),
+        'model_obs[1]': lambda: predict_model(models.model_obs, row[:, OBS_COLUMNS], FEATURES_OBS),
+        'model_CB[1]': lambda: predict_model(models.model_CB, row[:, CB_COLUMNS], FEATURES_CB),
+    }
+    result = dict((name, _ns_per_op(fn, 1, min_time)) for name, fn in timings.items())
+    result['batch_features[%d]' % k] = _ns_per_op(lambda: batch_features(*batch), k, min_time)
+    result['model_obs[%d]' % k] = _ns_per_op(
+        lambda: predict_model(models.model_obs, features[:, OBS_COLUMNS], FEATURES_OBS), k, min_time)
+    result['model_CB[%d]' % k] = _ns_per_op(
+        lambda: predict_model(models.model_CB, features[:, CB_COLUMNS], FEATURES_CB), k, min_time)
+    return result
+
+
+def latency(operations, requests=500):
+    ## single-request score latency in microseconds
+    from fault_engine import scorer
+    samples = []
+    for i in range(requests):
+        operation = operations[i % len(operations)]
+        started = time.time()
+        scorer.score(operation['time_stamp'], operation['current'], operation['pointMachineCode'])
+        samples.append(time.time() - started)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1e6
+    return {'p50_us': p50, 'p95_us': p95, 'p99_us': p99, 'mean_us': np.mean(samples) * 1e6}
+
+
+def throughput(operations, sizes=BATCH_SIZES, min_time=0.2):
+    ## score_ragged operations per second, per batch size
+    from fault_engine import scorer
+    from fault_engine.features import concatenate_operations
+    result = {}
+    for size in sizes:
+        TIMESTAMP, VALUE, offsets = concatenate_operations(operations[:size])
+        codes = [operation['pointMachineCode'] for operation in operations[:size]]
+        ns = _ns_per_op(lambda: scorer.score_ragged(TIMESTAMP, VALUE, offsets, codes), size, min_time)
+        result[str(size)] = 1e9 / ns
+    return result
+
+
+def run(min_time=0.2, requests=500, seed=0):
+    from fault_engine import scorer
+    scorer.warm_up()
+    scorer.result_cache.max_bytes = 0
+    operations = synthetic.operations(max(BATCH_SIZES), seed=seed)
+    return {'stages_ns_per_op': stage_timings(operations, min_time),
+            'latency': latency(operations, requests),
+            'throughput_ops_per_s': throughput(operations, min_time=min_time),
+            'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                            'machine': platform.machine(), 'compiled_models': scorer.registry.compiled}}
+
+
+def compare(result, baseline, tolerance):
+    ## (section, name, baseline, current, ratio) for numbers worse than tolerance allows
+    regressions = []
+    for section in ('stages_ns_per_op', 'latency', 'throughput_ops_per_s'):
+        for name, old in sorted(baseline.get(section, {}).items()):
+            new = result[section].get(name)
+            if new is None or not old:
+                continue
+            ## for throughput bigger is better, everything else is a time
+            ratio = old / new if section == 'throughput_ops_per_s' else new / old
+            if ratio > 1 + tolerance:
+                regressions.append((section, name, old, new, ratio))
+    return regressions
+
+
+def report(result, out=sys.stdout):
+    for name, ns in sorted(result['stages_ns_per_op'].items()):
+        out.write('%-28s %14.0f ns/op\n' % (name, ns))
+    out.write('score latency  p50 %.0f us  p95 %.0f us  p99 %.0f us\n'
+              % (result['latency']['p50_us'], result['latency']['p95_us'], result['latency']['p99_us']))
+    for size, rate in sorted(result['throughput_ops_per_s'].items(), key=lambda item: int(item[0])):
+        out.write('score_ragged x%-5s %12.0f ops/s\n' % (size, rate))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the fault-prediction pipeline.')
+    parser.add_argument('--save', help='write the results to this baseline file')
+    parser.add_argument('--compare', help='baseline file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, 0.2 = 20%%')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per timed run')
+    parser.add_argument('--requests', type=int, default=500, help='scorer.score calls for latency')
+    args = parser.parse_args(argv)
+
+    result = run(args.min_time, args.requests)
+    report(result)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        for section, name, old, new, ratio in regressions:
+            sys.stdout.write('REGRESSION %s %s: %.1f -> %.1f (%.2fx)\n' % (section, name, old, new, ratio))
+        if regressions:
+            raise SystemExit(1)
+        sys.stdout.write('no regressions beyond %.0f%%\n' % (args.tolerance * 100))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
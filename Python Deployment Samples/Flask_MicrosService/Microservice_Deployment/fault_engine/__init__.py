@@ -0,0 +1,21 @@
+
+# coding: utf-8
+
+"""Point-machine fault prediction, shared by the Flask service (run.py) and
+the analytics catalog driver (analytics/fault_engine links here).
+
+    from fault_engine import scorer
+    scorer.warm_up()
+    scorer.score(time_stamp, current, 'PT42_A')
+
+scorer is configured from the environment (MODEL_DIR, MODEL_VERSION,
+COMPILED_MODELS, BATCH_WINDOW_MS, RESULT_CACHE_BYTES, ...) and loads nothing
+until warm_up() or the first call.  Modules inside the package import each other
+relatively, so it works both as a top-level package and as a subpackage.
+"""
+
+from .labels import LABELS, LABEL_CODES, decode, get_label, label_code, label_codes
+from .model_registry import ModelRegistry, registry
+from .scorer import Scorer
+
+scorer = Scorer.from_env(registry)
@@ -0,0 +1,53 @@
+
+# coding: utf-8
+
+import numpy as np
+
+from .thresholds import PEAK_UNKNOWN
+
+
+## bits of a label code: each model's 1/0 outcome, PEAK_BIT from detect_peak
+OBSTRUCTION_BIT = 1
+CARBON_BRUSH_BIT = 2
+PEAK_BIT = 4
+UNKNOWN_CODE = 8
+
+## indexed by label code
+LABELS = ('Normal Operation',
+          'Obstruction Present',
+          'Carbon Brush Problem',
+          'Obstruction/Carbon Brush Issue',
+          'Peak Current Present',
+          'Obstruction/Peak Current Issue',
+          'Carbon Brush/Peak Current Issue',
+          'Obstruction/Carbon Brush/Peak Current Issue',
+          'Unknown Point Machine Code')
+LABEL_CODES = dict((label, code) for code, label in enumerate(LABELS))
+_LABEL_ARRAY = np.array(LABELS, dtype=object)
+
+
+def label_code(prediction_obs, prediction_cb, prediction_pk):
+    ## any nonzero model outcome sets its bit; PEAK_UNKNOWN overrides the rest
+    if prediction_pk == PEAK_UNKNOWN:
+        return UNKNOWN_CODE
+    return ((OBSTRUCTION_BIT if prediction_obs else 0) | (CARBON_BRUSH_BIT if prediction_cb else 0)
+            | (PEAK_BIT if prediction_pk else 0))
+
+
+def get_label(prediction_obs, prediction_cb, prediction_pk):
+    return LABELS[label_code(prediction_obs, prediction_cb, prediction_pk)]
+
+
+def label_codes(predictions_obs, predictions_cb, predictions_pk):
+    """label_code over whole arrays at once, as uint8 codes."""
+    predictions_pk = np.asarray(predictions_pk)
+    codes = ((np.asarray(predictions_obs) != 0) * OBSTRUCTION_BIT
+             | (np.asarray(predictions_cb) != 0) * CARBON_BRUSH_BIT
+             | (predictions_pk > 0) * PEAK_BIT).astype(np.uint8)
+    codes[predictions_pk == PEAK_UNKNOWN] = UNKNOWN_CODE
+    return codes
+
+
+def decode(codes):
+    ## label strings for an array of label codes
+    return _LABEL_ARRAY.take(np.asarray(codes, dtype=np.intp)).tolist()
@@ -0,0 +1,76 @@
+# coding: utf-8
+
+## The original per-operation pandas feature code.  Scoring uses the
+## vectorised features module; these stay as the reference implementation
+## and for benchmark.py.
+
+import pandas as pd
+import numpy as np
+from scipy.signal import argrelextrema
+from .thresholds import ThresholdIndex, detect_peak
+
+
+def create_features_obs(df_inst):
+    
+    df_inst = df_inst   
+    all_current_gradient = [] ## current gradient features 
+    tot_points = []  ## Total Points captured
+    all_duration = [] ## Duration of the operation cycle
+    
+    current_gradient = np.corrcoef(df_inst.Std_Value,df_inst.index.values)[0][1] 
+    all_current_gradient.append(current_gradient) ## get current gradient
+    
+    tot_points.append(df_inst.shape[0]) ## Get total points captured
+    
+    duration = df_inst.TIMESTAMP.max() - df_inst.TIMESTAMP.min()
+    all_duration.append(duration) ## Get duration of the operation cycle
+        
+    All_Features = pd.DataFrame()
+    All_Features['points_captured'] = tot_points
+    All_Features['current_gradient'] = all_current_gradient
+    All_Features['Duration'] = all_duration
+    return All_Features
+    
+    
+    
+def create_features_cb(df_inst):
+    
+    df_inst = df_inst
+    tot_max = []
+    tot_min = []
+    all_current_gradient = []
+    
+    All_Features_inst = df_inst
+    get_max = np.array(argrelextrema(np.array(All_Features_inst.VALUE), np.greater)).shape[1]
+    tot_max.append(get_max)
+    get_min = np.array(argrelextrema(np.array(All_Features_inst.VALUE), np.less)).shape[1]
+    tot_min.append(get_min)
+    current_gradient = np.corrcoef(All_Features_inst.VALUE,All_Features_inst.index.values)[0][1] 
+    all_current_gradient.append(current_gradient) ## get current gradient
+    all_features_cb = pd.DataFrame()
+    all_features_cb['tot_max'] = tot_max
+    all_features_cb['tot_min'] = tot_min
+    all_features_cb['slope'] = all_current_gradient
+    return all_features_cb
+
+
+def create_newstring(TIMESTAMP,VALUE,PM_Code):
+        TIMESTAMP = TIMESTAMP
+        VALUE = VALUE
+        PM_Code = PM_Code
+        operation_2 = pd.DataFrame()
+        operation_2['TIMESTAMP'] = TIMESTAMP
+        operation_2['VALUE'] = VALUE
+        operation_2['Std_Value'] = VALUE
+        operation_2['PM_Code'] = PM_Code
+        return operation_2
+
+    
+def create_features_pc(TIMESTAMP,VALUE,PM_Code,thresholds,STATION=None):
+    ## 1/0 for peak current present/absent, PEAK_UNKNOWN if PM_Code has no cutoff;
+    ## thresholds is a ThresholdIndex, or the threshold DataFrame as it used to be
+    if isinstance(thresholds,pd.DataFrame):
+        thresholds = ThresholdIndex.from_frame(thresholds)
+    cutoff = thresholds.cutoff(PM_Code,STATION)
+    max_current = np.max(VALUE)
+    return int(detect_peak(max_current,cutoff))
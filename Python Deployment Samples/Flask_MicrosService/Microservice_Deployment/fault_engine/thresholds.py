@@ -0,0 +1,91 @@
+
+# coding: utf-8
+
+import hashlib
+
+import numpy as np
+
+
+## create_features_pc/detect_peak result for a point machine missing from the table
+PEAK_UNKNOWN = -1
+
+
+class ThresholdIndex(object):
+    """Peak-current cutoffs from Threshold_limits_pointmachine.csv, hashed once.
+
+    Lookups go by PointMachineCode, or by (STATIONCODE, PointMachineCode)
+    when the station is known, since the same code appears at several
+    stations.  A code-only lookup returns the first row for that code, as
+    the old .unique()[0] scan did.  Unknown keys give NaN.  station_of gives
+    a code's station only when the table lists the code at one station, and
+    None when it is unknown or shared, so nothing is charged to a guess.
+    """
+
+    def __init__(self, stations, codes, cutoffs):
+        self.by_code = {}
+        self.by_station_code = {}
+        self.station_by_code = {}
+        for station, code, cutoff in zip(stations, codes, cutoffs):
+            self.by_code.setdefault(code, float(cutoff))
+            ## None once a code shows up at a second station
+            if self.station_by_code.setdefault(code, station) != station:
+                self.station_by_code[code] = None
+            self.by_station_code.setdefault((station, code), float(cutoff))
+
+    @classmethod
+    def from_frame(cls, data):
+        return cls(data['STATIONCODE'], data['PointMachineCode'], data['Cutoff'])
+
+    @classmethod
+    def from_csv(cls, path):
+        import pandas as pd
+        return cls.from_frame(pd.read_csv(path))
+
+    @classmethod
+    def from_table(cls, table):
+        return cls(table['STATIONCODE'], table['PointMachineCode'], table['Cutoff'])
+
+    def __len__(self):
+        return len(self.by_station_code)
+
+    def __contains__(self, PM_Code):
+        return PM_Code in self.by_code
+
+    def station_of(self, PM_Code):
+        return self.station_by_code.get(PM_Code)
+
+    def cutoff(self, PM_Code, station=None):
+        if station is None:
+            return self.by_code.get(PM_Code, np.nan)
+        return self.by_station_code.get((station, PM_Code), np.nan)
+
+    def cutoffs(self, codes, stations=None):
+        ## one cutoff per operation; stations may be None or hold None entries
+        if stations is None:
+            return np.array([self.by_code.get(code, np.nan) for code in codes], dtype=np.float64)
+        return np.array([self.cutoff(code, station) for code, station in zip(codes, stations)],
+                        dtype=np.float64)
+
+
+def table_digest(raw):
+    return hashlib.sha1(raw).hexdigest()
+
+
+def read_table(path):
+    ## the CSV's columns as plain lists, stamped with the sha1 of the file,
+    ## for the forest buffer header (see ThresholdIndex.from_table)
+    import pandas as pd
+    with open(path, 'rb') as f:
+        raw = f.read()
+    data = pd.read_csv(path)
+    return {'source': table_digest(raw), 'STATIONCODE': data['STATIONCODE'].tolist(),
+            'PointMachineCode': data['PointMachineCode'].tolist(), 'Cutoff': data['Cutoff'].astype(float).tolist()}
+
+
+def detect_peak(peak_current, cutoff):
+    ## 1 where the peak current is above the cutoff, 0 where it is not and
+    ## PEAK_UNKNOWN where there is no cutoff; works on scalars and arrays
+    cutoff = np.asarray(cutoff, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        above = np.greater(peak_current, cutoff).astype(np.int64)
+    return np.where(np.isnan(cutoff), PEAK_UNKNOWN, above)
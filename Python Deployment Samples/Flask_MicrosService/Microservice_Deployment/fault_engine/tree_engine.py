@@ -0,0 +1,409 @@
+
+# coding: utf-8
+
+"""Flat-array evaluator for the gbtree boosters.
+
+    python -m fault_engine.tree_engine export model_Obstruction model_CB
+    python -m fault_engine.tree_engine buffer model_Obstruction model_CB Threshold_limits_pointmachine.csv
+    python -m fault_engine.tree_engine bench model_Obstruction model_CB
+
+`export` writes model_Obstruction.npz/model_CB.npz next to the pickles,
+stamped with the sha1 of the pickle they came from; the model registry uses
+them instead of the pickles as long as that stamp still matches.
+`buffer` writes both forests, lookup tables included, into one flat
+model_forests.bin that every process maps read-only (see attach_buffer);
+a .csv argument stores that threshold table in the header as well, so the
+registry can start without reading the CSV through pandas.
+`bench` checks that the compiled forests match Booster.predict exactly and
+times both paths.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import struct
+import sys
+import time
+
+import numpy as np
+
+
+COMPILED_SUFFIX = '.npz'
+BUFFER_FILE = 'model_forests.bin'
+BUFFER_MAGIC = b'PMFOREST'
+BUFFER_HEADER = struct.Struct('<8sQ')
+BUFFER_ALIGN = 64
+SUPPORTED_OBJECTIVES = ('multi:softmax',)
+
+
+class CompiledForest(object):
+    """A multi:softmax gbtree booster flattened into NumPy arrays.
+
+    Node i splits on feature[i]: x < threshold[i] goes to left[i], otherwise
+    to right[i], and NaN goes to missing[i].  Leaves point to themselves and
+    carry value[i], so max_depth steps of the walk land every row on a leaf.
+    Tree t starts at roots[t] and adds to the margin of class tree_class[t].
+    Margins are accumulated in float32 in tree order from base_score, the
+    same way xgboost does, so the margins and classes are bit-identical.
+
+    Every split compares one feature against one of that feature's
+    thresholds, so the margin only depends on which threshold interval (or
+    NaN) each feature falls in.  When that grid has at most TABLE_LIMIT
+    cells, the walk is run once over one representative row per cell and
+    predict_margin becomes a searchsorted per feature plus a table lookup.
+    A table passed in (from attach_buffer) is used as is instead of being
+    rebuilt.
+    """
+
+    TABLE_LIMIT = 1 << 18
+    ARRAYS = ('feature', 'threshold', 'left', 'right', 'missing', 'value', 'roots', 'tree_class')
+
+    def __init__(self, feature, threshold, left, right, missing, value, roots, tree_class,
+                 num_class, base_score, max_depth, feature_names, source=None, table=None):
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float32)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.missing = np.asarray(missing, dtype=np.int32)
+        self.value = np.asarray(value, dtype=np.float32)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.tree_class = np.asarray(tree_class, dtype=np.int32)
+        self.num_class = int(num_class)
+        self.base_score = np.float32(base_score)
+        self.max_depth = int(max_depth)
+        self.feature_names = list(feature_names)
+        self.source = source
+        ## walk-time copies: intp indices and left/right interleaved per node
+        self._feature = self.feature.astype(np.intp)
+        self._children = np.column_stack((self.left, self.right)).ravel().astype(np.intp)
+        self._missing = self.missing.astype(np.intp)
+        self._roots = self.roots.astype(np.intp)
+        self._class_trees = [np.flatnonzero(self.tree_class == c) for c in range(self.num_class)]
+        self._build_table(table)
+
+    def _build_table(self, table=None):
+        internal = self.left != np.arange(self.feature.shape[0])
+        self._splits = [np.unique(self.threshold[internal & (self.feature == j)])
+                        for j in range(len(self.feature_names))]
+        self._cells = tuple(splits.shape[0] + 2 for splits in self._splits)
+        self._table = None
+        if np.prod(self._cells) > self.TABLE_LIMIT:
+            return
+        if table is not None and table.shape == (np.prod(self._cells), self.num_class):
+            self._table = table
+            return
+        ## cell b of feature j holds splits[b - 1] <= x < splits[b]; the last cell is NaN
+        representatives = []
+        for splits in self._splits:
+            below = np.nextafter(splits[:1], np.float32(-np.inf)) if splits.shape[0] else np.zeros(1)
+            representatives.append(np.concatenate((below, splits, [np.nan])).astype(np.float32))
+        grid = np.meshgrid(*representatives, indexing='ij')
+        self._table = self.walk_margin(np.column_stack([axis.ravel() for axis in grid]))
+
+    def leaves(self, X):
+        ## (rows, trees) leaf values reached by every row in every tree
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[np.newaxis]
+        rows = X.shape[0]
+        columns = np.ascontiguousarray(X.T).ravel()
+        row = np.arange(rows, dtype=np.intp)[:, np.newaxis]
+        has_missing = np.isnan(columns).any()
+        node = np.repeat(self._roots[np.newaxis], rows, axis=0)
+        for _ in range(self.max_depth):
+            x = columns.take(self._feature.take(node) * rows + row)
+            child = self._children.take(2 * node + (x >= self.threshold.take(node)))
+            if has_missing:
+                gap = np.isnan(x)
+                child[gap] = self._missing.take(node[gap])
+            node = child
+        return self.value.take(node)
+
+    def walk_margin(self, X):
+        leaves = self.leaves(X)
+        margin = np.empty((leaves.shape[0], self.num_class), dtype=np.float32)
+        start = np.full((leaves.shape[0], 1), self.base_score, dtype=np.float32)
+        for c, trees in enumerate(self._class_trees):
+            steps = np.concatenate((start, leaves[:, trees]), axis=1)
+            margin[:, c] = np.add.accumulate(steps, axis=1, dtype=np.float32)[:, -1]
+        return margin
+
+    def predict_margin(self, X):
+        if self._table is None:
+            return self.walk_margin(X)
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[np.newaxis]
+        bins = []
+        for j, splits in enumerate(self._splits):
+            column = X[:, j]
+            bins.append(np.where(np.isnan(column), splits.shape[0] + 1,
+                                 np.searchsorted(splits, column, side='right')))
+        return self._table.take(np.ravel_multi_index(bins, self._cells), axis=0)
+
+    def predict(self, X):
+        ## class index as float32, like Booster.predict for multi:softmax
+        return np.argmax(self.predict_margin(X), axis=1).astype(np.float32)
+
+
+def _learner_params(booster):
+    config = json.loads(booster.save_config())['learner']
+    objective = config['objective']['name']
+    num_class = int(config['learner_model_param']['num_class'])
+    base_score = float(config['learner_model_param']['base_score'])
+    parallel = int(config['gradient_booster'].get('gbtree_model_param', {}).get('num_parallel_tree', 1))
+    return objective, num_class, base_score, parallel
+
+
+def export_booster(booster, objective=None, num_class=None, base_score=None, num_parallel_tree=1):
+    """Flatten booster into a CompiledForest.
+
+    Learner parameters are read from booster.save_config() when the keyword
+    arguments are left as None; xgboost builds without save_config need them
+    passed explicitly.
+    """
+    if objective is None or num_class is None or base_score is None:
+        objective, num_class, base_score, num_parallel_tree = _learner_params(booster)
+    if objective not in SUPPORTED_OBJECTIVES:
+        raise ValueError('cannot compile objective %r' % objective)
+    names = list(booster.feature_names or [])
+    trees = [json.loads(dump) for dump in booster.get_dump(dump_format='json')]
+
+    feature, threshold, left, right, missing, value, roots, tree_class = ([] for _ in range(8))
+    max_depth = 0
+    for t, tree in enumerate(trees):
+        nodes = {}
+        stack = [(tree, 0)]
+        while stack:
+            node, depth = stack.pop()
+            nodes[node['nodeid']] = node
+            max_depth = max(max_depth, depth)
+            for child in node.get('children', []):
+                stack.append((child, depth + 1))
+        offset = len(feature)
+        roots.append(offset)
+        tree_class.append((t // num_parallel_tree) % num_class)
+        for nodeid in range(max(nodes) + 1):
+            node = nodes.get(nodeid, {'leaf': 0.0})
+            if 'leaf' in node:
+                feature.append(0)
+                threshold.append(0.0)
+                left.append(offset + nodeid)
+                right.append(offset + nodeid)
+                missing.append(offset + nodeid)
+                value.append(node['leaf'])
+            else:
+                split = node['split']
+                feature.append(names.index(split) if split in names else int(split.lstrip('f')))
+                threshold.append(node['split_condition'])
+                left.append(offset + node['yes'])
+                right.append(offset + node['no'])
+                missing.append(offset + node['missing'])
+                value.append(0.0)
+    return CompiledForest(feature, threshold, left, right, missing, value, roots, tree_class,
+                          num_class, base_score, max_depth, names)
+
+
+def source_digest(raw):
+    return hashlib.sha1(raw).hexdigest()
+
+
+def save_forest(forest, path):
+    meta = {'num_class': forest.num_class, 'base_score': float(forest.base_score),
+            'max_depth': forest.max_depth, 'feature_names': forest.feature_names,
+            'source': forest.source}
+    arrays = dict((name, getattr(forest, name)) for name in CompiledForest.ARRAYS)
+    with open(path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+
+
+def load_forest(path):
+    data = np.load(path)
+    try:
+        meta = json.loads(str(data['meta']))
+        arrays = [data[name] for name in CompiledForest.ARRAYS]
+    finally:
+        data.close()
+    return CompiledForest(*arrays, num_class=meta['num_class'], base_score=meta['base_score'],
+                          max_depth=meta['max_depth'], feature_names=meta['feature_names'],
+                          source=meta.get('source'))
+
+
+def write_buffer(forests, path, thresholds=None, meta=None):
+    """Write {name: CompiledForest} to one flat file for attach_buffer.
+
+    Layout: BUFFER_HEADER (magic, JSON length), the JSON header, then every
+    array at a BUFFER_ALIGN aligned offset, native little-endian.
+    thresholds, a thresholds.read_table dict, and meta go into the header
+    as they are.  The header's checksum covers the rest of the header and
+    the array data (see buffer_checksum).
+    """
+    models = {}
+    arrays = []
+    position = 0
+    for name, forest in sorted(forests.items()):
+        entry = {'num_class': forest.num_class, 'base_score': float(forest.base_score),
+                 'max_depth': forest.max_depth, 'feature_names': forest.feature_names,
+                 'source': forest.source, 'arrays': {}}
+        named = [(array, getattr(forest, array)) for array in CompiledForest.ARRAYS]
+        if forest._table is not None:
+            named.append(('table', forest._table))
+        for array, values in named:
+            values = np.ascontiguousarray(values)
+            position += -position % BUFFER_ALIGN
+            entry['arrays'][array] = [position, values.dtype.str, list(values.shape)]
+            arrays.append((position, values))
+            position += values.nbytes
+        models[name] = entry
+    data = bytearray(position)
+    for offset, values in arrays:
+        data[offset:offset + values.nbytes] = values.tobytes()
+    header = {'models': models}
+    if thresholds is not None:
+        header['thresholds'] = thresholds
+    if meta is not None:
+        header['meta'] = meta
+    header['checksum'] = buffer_checksum(header, data)
+    header = json.dumps(header).encode('utf-8')
+    start = BUFFER_HEADER.size + len(header)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(BUFFER_HEADER.pack(BUFFER_MAGIC, len(header)))
+        f.write(header)
+        f.write(b'\0' * (-start % BUFFER_ALIGN))
+        f.write(bytes(data))
+    os.rename(path + '.tmp', path)
+
+
+def buffer_checksum(header, data):
+    ## sha256 of the header minus its checksum, dumped canonically, then the array data
+    fields = dict((key, value) for key, value in header.items() if key != 'checksum')
+    digest = hashlib.sha256(json.dumps(fields, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def read_header(path):
+    ## (JSON header, offset of the first byte after it)
+    with open(path, 'rb') as f:
+        magic, length = BUFFER_HEADER.unpack(f.read(BUFFER_HEADER.size))
+        if magic != BUFFER_MAGIC:
+            raise ValueError('%s is not a forest buffer' % path)
+        return json.loads(f.read(length).decode('utf-8')), BUFFER_HEADER.size + length
+
+
+def attach_buffer(path, verify=False):
+    """{name: CompiledForest} whose arrays are read-only views of a memmap.
+
+    The pages belong to the page cache, so every process that attaches the
+    same file shares one copy of the forests and their lookup tables.
+    verify=True checks the checksum over the header and the arrays first,
+    which reads the file once, and refuses buffers without one.
+    """
+    return read_buffer(path, verify)[0]
+
+
+def read_buffer(path, verify=False):
+    ## (forests, JSON header) as attach_buffer, both taken from one mapping
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    magic, length = BUFFER_HEADER.unpack(buffer[:BUFFER_HEADER.size].tobytes())
+    if magic != BUFFER_MAGIC:
+        raise ValueError('%s is not a forest buffer' % path)
+    header = json.loads(buffer[BUFFER_HEADER.size:BUFFER_HEADER.size + length].tobytes().decode('utf-8'))
+    start = BUFFER_HEADER.size + length
+    start += -start % BUFFER_ALIGN
+    if verify and buffer_checksum(header, buffer[start:]) != header.get('checksum'):
+        raise ValueError('%s does not match its checksum' % path)
+    forests = {}
+    for name, entry in header['models'].items():
+        arrays = {}
+        for array, (offset, dtype, shape) in entry['arrays'].items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape))
+            begin = start + offset
+            arrays[array] = buffer[begin:begin + count * dtype.itemsize].view(dtype).reshape(shape)
+        forests[name] = CompiledForest(*[arrays[array] for array in CompiledForest.ARRAYS],
+                                       num_class=entry['num_class'], base_score=entry['base_score'],
+                                       max_depth=entry['max_depth'], feature_names=entry['feature_names'],
+                                       source=entry['source'], table=arrays.get('table'))
+    return forests, header
+
+
+def boundary_matrix(forest, rows, seed=0):
+    ## feature rows drawn around the split thresholds, including exact ties and NaNs
+    rng = np.random.RandomState(seed)
+    X = np.empty((rows, len(forest.feature_names)), dtype=np.float32)
+    for j in range(X.shape[1]):
+        splits = forest.threshold[(forest.feature == j) & (forest.left != np.arange(len(forest.feature)))]
+        if splits.shape[0] == 0:
+            splits = np.zeros(1, dtype=np.float32)
+        column = rng.choice(splits, rows)
+        jitter = rng.choice([-1.0, 0.0, 1.0], rows) * rng.rand(rows) * (np.abs(column) + 1) * 0.01
+        X[:, j] = column + jitter
+    X[rng.rand(*X.shape) < 0.01] = np.nan
+    return X
+
+
+def mismatches(booster, forest, X):
+    ## rows whose class or margin bits differ from Booster.predict
+    import xgboost as xgb
+    d_test = xgb.DMatrix(X, feature_names=forest.feature_names)
+    margin = booster.predict(d_test, output_margin=True).reshape(X.shape[0], -1).view(np.uint32)
+    return {'class': int(np.sum(booster.predict(d_test) != forest.predict(X))),
+            'margin': int(np.sum(np.any(margin != forest.predict_margin(X).view(np.uint32), axis=1))),
+            'walk': int(np.sum(np.any(margin != forest.walk_margin(X).view(np.uint32), axis=1)))}
+
+
+def _timed(fn, repeat):
+    started = time.time()
+    for _ in range(repeat):
+        fn()
+    return (time.time() - started) / repeat
+
+
+def bench(booster, forest, sizes=(1, 64, 4096)):
+    import xgboost as xgb
+    for rows in sizes:
+        X = boundary_matrix(forest, rows)
+        repeat = max(1, 2000 // rows)
+        xgb_time = _timed(lambda: booster.predict(xgb.DMatrix(X, feature_names=forest.feature_names)), repeat)
+        walk_time = _timed(lambda: forest.walk_margin(X), repeat)
+        compiled_time = _timed(lambda: forest.predict(X), repeat)
+        sys.stdout.write('%6d rows  xgboost %9.1f us  walk %9.1f us  compiled %9.1f us  mismatches %s\n'
+                         % (rows, xgb_time * 1e6, walk_time * 1e6, compiled_time * 1e6,
+                            mismatches(booster, forest, X)))
+
+
+def main(argv):
+    command, paths = argv[0], argv[1:]
+    forests = {}
+    thresholds = None
+    for path in paths:
+        if command == 'buffer' and path.endswith('.csv'):
+            from .thresholds import read_table
+            thresholds = read_table(path)
+            continue
+        with open(path, 'rb') as f:
+            raw = f.read()
+        booster = pickle.loads(raw)
+        forest = export_booster(booster)
+        forest.source = source_digest(raw)
+        if command == 'export':
+            save_forest(forest, path + COMPILED_SUFFIX)
+            sys.stdout.write('%s -> %s%s\n' % (path, path, COMPILED_SUFFIX))
+        elif command == 'buffer':
+            forests[os.path.basename(path)] = forest
+        elif command == 'bench':
+            sys.stdout.write('%s\n' % path)
+            bench(booster, forest)
+        else:
+            raise SystemExit(__doc__)
+    if forests:
+        target = os.path.join(os.path.dirname(paths[0]), BUFFER_FILE)
+        write_buffer(forests, target, thresholds)
+        sys.stdout.write('%s -> %s\n' % (', '.join(sorted(forests) + ([paths[-1]] if thresholds else [])),
+                                         target))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
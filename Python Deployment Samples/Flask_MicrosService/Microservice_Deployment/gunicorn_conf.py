@@ -0,0 +1,22 @@
+
+# coding: utf-8
+
+## Production serving mode: gunicorn -c gunicorn_conf.py run:app
+##
+## run.py warms the model registry at import, and preload_app imports it in
+## the master before forking, so every worker shares the boosters and the
+## threshold index copy-on-write instead of loading its own copy.  The
+## compiled forests come from model_forests.bin, mapped read-only, so they
+## stay shared even in workers that reload the models after a file change.  gthread
+## workers keep slow clients on their own threads; the actual predict calls
+## go through the bounded serving.pool in each worker.
+
+import os
+
+bind = '0.0.0.0:%s' % os.getenv('PORT', '3000')
+preload_app = True
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = os.getenv('WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WORKER_THREADS', 8))
+timeout = int(os.getenv('WORKER_TIMEOUT', 60))
+keepalive = 5
@@ -0,0 +1,224 @@
+
+# coding: utf-8
+
+"""Load generator for the fault-prediction service.
+
+    python loadtest.py --concurrency 8 --requests 2000
+    python loadtest.py --url http://localhost:3000 --rate 200 --duration 30
+    python loadtest.py --sweep 1,2,4,8,16,32 --mode binary --batch-size 64
+    python loadtest.py --payloads recorded.jsonl --save gthread.json
+    python loadtest.py --compare sync.json gthread.json
+
+Without --url, requests go through the Flask test client of run.py in this
+process.  Payloads are read from a JSON lines file, one request body or
+data.time_series dict per line, or generated with synthetic.operations.
+Modes: json posts one operation to /, batch posts --batch-size operations
+as JSON to /batch, binary posts them as application/x-pm-timeseries.
+
+With --rate, requests are scheduled at fixed intervals and latency is
+counted from the scheduled time, so a stalled server shows up as latency
+rather than as fewer requests sent.  Without it, every thread sends its
+next request as soon as the last one returns.
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPError, URLError
+
+import synthetic
+import wire
+
+
+class InProcessTarget(object):
+
+    def __init__(self):
+        import run
+        self.app = run.app
+        self._local = threading.local()
+
+    def post(self, path, body, content_type):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client.post(path, data=body, content_type=content_type).status_code
+
+
+class HttpTarget(object):
+
+    def __init__(self, url, timeout=60.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def post(self, path, body, content_type):
+        request = Request(self.url + path, data=body, headers={'Content-Type': content_type})
+        try:
+            response = urlopen(request, timeout=self.timeout)
+            try:
+                response.read()
+                return response.getcode()
+            finally:
+                response.close()
+        except HTTPError as e:
+            return e.code
+
+
+def load_payloads(path):
+    ## data.time_series dicts from a JSON lines file of request bodies or bare operations
+    operations = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            payload = json.loads(line)
+            if 'data' in payload:
+                payload = payload['data']['time_series']
+            operations.extend(payload if isinstance(payload, list) else [payload])
+    return operations
+
+
+def build_requests(operations, mode, batch_size=64):
+    ## (path, body, content type, operations) per request
+    if mode == 'json':
+        return [('/', json.dumps({'data': {'time_series': operation}}).encode('utf-8'),
+                 'application/json', 1) for operation in operations]
+    batches = [operations[i:i + batch_size] for i in range(0, len(operations), batch_size)]
+    if mode == 'batch':
+        return [('/batch', json.dumps({'data': {'time_series': batch}}).encode('utf-8'),
+                 'application/json', len(batch)) for batch in batches]
+    if mode == 'binary':
+        return [('/batch', wire.encode(batch), wire.CONTENT_TYPE, len(batch)) for batch in batches]
+    raise ValueError('unknown mode %r' % mode)
+
+
+def run_load(target, requests, concurrency=4, rate=0.0, count=None, duration=None):
+    """Send requests round-robin from `concurrency` threads.
+
+    Stops after `count` requests or `duration` seconds, whichever comes
+    first (count defaults to one pass over requests when neither is given).
+    """
+    if count is None and duration is None:
+        count = len(requests)
+    sequence = itertools.count()
+    results = []
+    lock = threading.Lock()
+    started = time.time()
+
+    def worker():
+        local = []
+        while True:
+            i = next(sequence)
+            if count is not None and i >= count:
+                break
+            scheduled = started + i / rate if rate > 0 else time.time()
+            if duration is not None and scheduled - started >= duration:
+                break
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            path, body, content_type, operations = requests[i % len(requests)]
+            try:
+                status = target.post(path, body, content_type)
+            except (URLError, IOError):
+                status = 0
+            local.append((time.time() - scheduled, status, operations))
+        with lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(results, time.time() - started, concurrency, rate)
+
+
+def summarize(results, elapsed, concurrency, rate):
+    latencies = np.array([latency for latency, _, _ in results]) if results else np.zeros(1)
+    errors = sum(1 for _, status, _ in results if status != 200)
+    operations = sum(count for _, status, count in results if status == 200)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {'concurrency': concurrency, 'rate': rate, 'requests': len(results), 'errors': errors,
+            'error_rate': float(errors) / len(results) if results else 0.0,
+            'requests_per_s': len(results) / elapsed, 'operations_per_s': operations / elapsed,
+            'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'max_ms': latencies.max() * 1000}
+
+
+def saturation(levels, gain=0.1, max_error_rate=0.01):
+    ## first sweep level that adds less than `gain` throughput or starts failing
+    for previous, level in zip(levels, levels[1:]):
+        if level['error_rate'] > max_error_rate or \
+                level['requests_per_s'] < previous['requests_per_s'] * (1 + gain):
+            return previous
+    return None
+
+
+def report(result, out=sys.stdout):
+    out.write('c=%-3d %7.1f req/s %8.1f ops/s  p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms  errors %.2f%%\n'
+              % (result['concurrency'], result['requests_per_s'], result['operations_per_s'],
+                 result['p50_ms'], result['p95_ms'], result['p99_ms'], result['error_rate'] * 100))
+
+
+def compare(paths, out=sys.stdout):
+    for path in paths:
+        with open(path) as f:
+            runs = json.load(f)
+        out.write('%s (%s)\n' % (path, runs['label']))
+        for result in runs['levels']:
+            report(result, out)
+        if runs.get('saturation'):
+            out.write('saturates at concurrency %d\n' % runs['saturation']['concurrency'])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Load test the fault-prediction service.')
+    parser.add_argument('--url', help='server to test, e.g. http://localhost:3000; default in-process')
+    parser.add_argument('--payloads', help='JSON lines file of recorded payloads')
+    parser.add_argument('--synthetic', type=int, default=512, help='synthetic operations when no payloads')
+    parser.add_argument('--mode', choices=('json', 'batch', 'binary'), default='json')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--sweep', help='comma separated concurrency levels, reports the saturation point')
+    parser.add_argument('--rate', type=float, default=0.0, help='requests per second, 0 for closed loop')
+    parser.add_argument('--requests', type=int, help='requests per level')
+    parser.add_argument('--duration', type=float, help='seconds per level')
+    parser.add_argument('--label', help='name for this run in --save output')
+    parser.add_argument('--save', help='write the results as JSON')
+    parser.add_argument('--compare', nargs='+', help='print saved runs side by side and exit')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(args.compare)
+        return
+    operations = load_payloads(args.payloads) if args.payloads else synthetic.operations(args.synthetic)
+    requests = build_requests(operations, args.mode, args.batch_size)
+    target = HttpTarget(args.url) if args.url else InProcessTarget()
+    levels = [int(level) for level in args.sweep.split(',')] if args.sweep else [args.concurrency]
+
+    results = []
+    for concurrency in levels:
+        result = run_load(target, requests, concurrency, args.rate, args.requests, args.duration)
+        report(result)
+        results.append(result)
+    saturated = saturation(results) if len(results) > 1 else None
+    if saturated is not None:
+        sys.stdout.write('saturates at concurrency %d\n' % saturated['concurrency'])
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'label': args.label or '%s %s' % (args.url or 'in-process', args.mode),
+                       'mode': args.mode, 'levels': results, 'saturation': saturated}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
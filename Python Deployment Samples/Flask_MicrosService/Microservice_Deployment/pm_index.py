@@ -0,0 +1,159 @@
+
+# coding: utf-8
+
+"""Per point machine time index over an OperationArchive.
+
+    python pm_index.py store/ PT42_A --station BHUVANESHWAR --start 1500000000000 --end 1500604800000
+
+Operations are keyed by (STATIONCODE, PointMachineCode).  An operation
+stored without a station gets its code's station only when
+Threshold_limits_pointmachine.csv lists the code at one station; otherwise
+it is kept under no station and only a query without --station finds it.
+Each key holds the operations' start times in
+sorted order next to their archive indices, so a time range is two
+searchsorted calls.  The index is saved as pm_index.npz inside the store and
+update() only reads the operations appended since it was last saved.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+
+INDEX_FILE = 'pm_index.npz'
+## bumped when the keying changes; an index of another version is rebuilt
+INDEX_VERSION = 2
+
+
+class TimeIndex(object):
+
+    def __init__(self, archive, thresholds=None):
+        self.archive = archive
+        if thresholds is None:
+            from fault_engine import registry
+            thresholds = registry.get().thresholds
+        self.thresholds = thresholds
+        self.indexed = 0
+        self.starts = {}
+        self.operations = {}
+        self.load()
+
+    @property
+    def path(self):
+        return os.path.join(self.archive.path, INDEX_FILE)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        data = np.load(self.path)
+        try:
+            meta = json.loads(str(data['meta']))
+            starts, operations, bounds = data['starts'], data['operations'], data['bounds']
+        finally:
+            data.close()
+        if meta.get('version') != INDEX_VERSION:
+            return
+        self.indexed = meta['indexed']
+        for i, key in enumerate(meta['keys']):
+            self.starts[tuple(key)] = starts[bounds[i]:bounds[i + 1]]
+            self.operations[tuple(key)] = operations[bounds[i]:bounds[i + 1]]
+
+    def save(self):
+        keys = sorted(self.starts, key=lambda key: (key[0] or '', key[1]))
+        bounds = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(self.starts[key]) for key in keys], out=bounds[1:])
+        meta = {'version': INDEX_VERSION, 'indexed': self.indexed, 'keys': keys}
+        empty = np.zeros(0, dtype=np.int64)
+        with open(self.path + '.tmp', 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), bounds=bounds,
+                     starts=np.concatenate([self.starts[key] for key in keys] or [empty]),
+                     operations=np.concatenate([self.operations[key] for key in keys] or [empty]))
+        os.rename(self.path + '.tmp', self.path)
+
+    def update(self):
+        """Index the operations appended to the archive since the last update."""
+        self.archive.refresh()
+        first, last = self.indexed, len(self.archive)
+        if last <= first:
+            return 0
+        new = np.arange(first, last, dtype=np.int64)
+        begins = self.archive.offsets[first:last]
+        starts = np.asarray(self.archive.TIMESTAMP[begins], dtype=np.int64)
+        keys = [(station if station is not None else self.thresholds.station_of(code), code)
+                for code, station in zip(self.archive.codes(slice(first, last)),
+                                         self.archive.stations(slice(first, last)))]
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(key, []).append(i)
+        for key, rows in groups.items():
+            rows = np.asarray(rows, dtype=np.intp)
+            key_starts = np.concatenate((self.starts.get(key, starts[:0]), starts[rows]))
+            key_operations = np.concatenate((self.operations.get(key, new[:0]), new[rows]))
+            ## stable, so operations starting together stay in archive order
+            order = np.argsort(key_starts, kind='mergesort')
+            self.starts[key] = key_starts[order]
+            self.operations[key] = key_operations[order]
+        self.indexed = last
+        self.save()
+        return last - first
+
+    def keys(self):
+        return sorted(self.starts, key=lambda key: (key[0] or '', key[1]))
+
+    def query(self, PM_Code, station=None, start=None, end=None):
+        """Archive indices of PM_Code's operations starting in [start, end).
+
+        Without a station every station's PM_Code is included, along with
+        the operations stored without one whose code is listed at several
+        stations; with a station only operations known to have run there
+        are.  The result
+        is ordered by start time and goes straight to
+        OperationArchive.score_operations or OperationArchive.select.
+        """
+        keys = [key for key in self.starts if key[1] == PM_Code and (station is None or key[0] == station)]
+        found = []
+        found_starts = []
+        for key in keys:
+            starts = self.starts[key]
+            low = 0 if start is None else np.searchsorted(starts, start, side='left')
+            high = len(starts) if end is None else np.searchsorted(starts, end, side='left')
+            found.append(self.operations[key][low:high])
+            found_starts.append(starts[low:high])
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        if len(found) == 1:
+            return found[0]
+        order = np.argsort(np.concatenate(found_starts), kind='mergesort')
+        return np.concatenate(found)[order]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Score one point machine over a time range.')
+    parser.add_argument('archive')
+    parser.add_argument('code')
+    parser.add_argument('--station')
+    parser.add_argument('--start', type=int)
+    parser.add_argument('--end', type=int)
+    args = parser.parse_args(argv)
+
+    from archive import OperationArchive
+    from fault_engine import decode, scorer
+    scorer.warm_up()
+    archive = OperationArchive(args.archive)
+    index = TimeIndex(archive)
+    added = index.update()
+    indices = index.query(args.code, args.station, args.start, args.end)
+    sys.stderr.write('%d operations indexed (%d new), %d match\n' % (index.indexed, added, len(indices)))
+    sys.stdout.write('operationId,stationCode,start,value\n')
+    offsets = archive.offsets
+    for batch, label_codes in archive.score_operations(indices, label=scorer.label_codes):
+        for i, station, label in zip(batch, archive.stations(batch), decode(label_codes)):
+            sys.stdout.write('%s,%s,%d,%s\n' % (archive.operation_ids[i], station or '',
+                                                archive.TIMESTAMP[offsets[i]], label))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,203 @@
+
+# coding: utf-8
+
+"""Re-score archived point-machine operations in bulk.
+
+    python rescore.py archive/2017-*/ --out labels/ --workers 4
+
+Every input file (CSV, or Parquet with pyarrow installed) holds one row per
+sample with operationId, pointMachineCode, time_stamp, current and
+optionally stationCode columns.  Files are shared out to a process pool
+whose workers load the models once, and each file's labels are written to
+OUT/<file name>.<hash of its absolute path>.labels.csv as soon as it is
+scored (with --codes, as fault_engine.LABELS indices instead of label
+strings).  Directories, named or matched by a glob, contribute the CSV and
+Parquet files directly inside them.  Finished files are recorded in
+OUT/_checkpoint.jsonl, so a rerun skips every input whose size and mtime
+have not changed.  A file that fails is reported and left out of the
+checkpoint, the others still finish, and the exit status is 1.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+
+CHECKPOINT = '_checkpoint.jsonl'
+COLUMNS = {'id': 'operationId', 'code': 'pointMachineCode', 'station': 'stationCode',
+           'time': 'time_stamp', 'current': 'current'}
+
+
+def input_files(paths):
+    ## CSV and Parquet files named, matched by a glob, or directly inside a
+    ## named or matched directory; each file once
+    files = []
+    seen = set()
+    for path in paths:
+        for match in [path] if os.path.isdir(path) else sorted(glob.glob(path)):
+            if os.path.isdir(match):
+                candidates = [os.path.join(match, name) for name in sorted(os.listdir(match))]
+            else:
+                candidates = [match]
+            for candidate in candidates:
+                key = os.path.abspath(candidate)
+                if candidate.endswith(('.csv', '.parquet')) and os.path.isfile(candidate) and key not in seen:
+                    seen.add(key)
+                    files.append(candidate)
+    return files
+
+
+def read_operations(path, columns=COLUMNS):
+    """One archive file -> (operation ids, codes, stations, TIMESTAMP, VALUE, offsets).
+
+    A file with no rows gives zero operations.
+    """
+    if path.endswith('.parquet'):
+        frame = pd.read_parquet(path)
+    else:
+        frame = pd.read_csv(path)
+    frame = frame.sort_values([columns['id'], columns['time']], kind='mergesort')
+    ids = frame[columns['id']].values
+    starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))[:len(ids)]
+    offsets = np.append(starts, len(ids)).astype(np.int64)
+    codes = frame[columns['code']].values[starts].tolist()
+    if columns['station'] in frame:
+        stations = [None if pd.isnull(station) else str(station)
+                    for station in frame[columns['station']].values[starts]]
+    else:
+        stations = [None] * len(starts)
+    return (ids[starts].tolist(), codes, stations, frame[columns['time']].values.astype(np.int64),
+            frame[columns['current']].values.astype(np.float64), offsets)
+
+
+def output_path(out_dir, path):
+    ## keyed by the absolute path too, so 2017-01/part-0.csv and
+    ## 2017-02/part-0.csv do not write (or race on) the same file
+    key = os.path.abspath(path)
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    digest = hashlib.sha1(key).hexdigest()[:10]
+    return os.path.join(out_dir, '%s.%s.labels.csv' % (os.path.basename(path), digest))
+
+
+def _init_worker():
+    from fault_engine import scorer
+    scorer.warm_up()
+
+
+def score_file(task):
+    ## (path, operations, seconds, error); error is None unless the file failed
+    path = task[0]
+    started = time.time()
+    try:
+        count = _score_file(*task)
+    except Exception as e:
+        return path, 0, time.time() - started, '%s: %s' % (type(e).__name__, e)
+    return path, count, time.time() - started, None
+
+
+def _score_file(path, out_dir, as_codes):
+    from fault_engine import decode, scorer
+    from fault_engine.features import batch_features
+    ids, codes, stations, TIMESTAMP, VALUE, offsets = read_operations(path)
+    if ids:
+        label_codes = scorer.label_codes(batch_features(TIMESTAMP, VALUE, offsets), codes, stations)
+    else:
+        label_codes = np.zeros(0, dtype=np.uint8)
+    column = 'label_code' if as_codes else 'value'
+    result = pd.DataFrame({'operationId': ids, 'pointMachineCode': codes, 'stationCode': stations,
+                           column: label_codes if as_codes else decode(label_codes)},
+                          columns=['operationId', 'pointMachineCode', 'stationCode', column])
+    target = output_path(out_dir, path)
+    result.to_csv(target + '.tmp', index=False)
+    os.rename(target + '.tmp', target)
+    return len(ids)
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def load_checkpoint(out_dir):
+    done = {}
+    checkpoint = os.path.join(out_dir, CHECKPOINT)
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            for line in f:
+                entry = json.loads(line)
+                done[entry['path']] = entry
+    return done
+
+
+def pending_files(files, out_dir):
+    done = load_checkpoint(out_dir)
+    pending = []
+    for path in files:
+        stamp = _stamp(path)
+        entry = done.get(stamp['path'])
+        if entry is None or entry['size'] != stamp['size'] or entry['mtime'] != stamp['mtime'] \
+                or not os.path.exists(output_path(out_dir, path)):
+            pending.append(path)
+    return pending
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Re-score archived point-machine operations.')
+    parser.add_argument('inputs', nargs='+', help='files, globs or directories of CSV/Parquet')
+    parser.add_argument('--out', required=True, help='directory for labels and the checkpoint')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--codes', action='store_true', help='write integer label codes, not strings')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    files = input_files(args.inputs)
+    pending = pending_files(files, args.out)
+    sys.stderr.write('%d files, %d already scored\n' % (len(files), len(files) - len(pending)))
+    if not pending:
+        return
+
+    started = time.time()
+    operations = 0
+    failed = []
+    pool = multiprocessing.Pool(args.workers, initializer=_init_worker)
+    try:
+        with open(os.path.join(args.out, CHECKPOINT), 'a') as checkpoint:
+            tasks = [(path, args.out, args.codes) for path in pending]
+            for done, (path, count, seconds, error) in enumerate(pool.imap_unordered(score_file, tasks), 1):
+                if error is not None:
+                    failed.append(path)
+                    sys.stderr.write('[%d/%d] %s: FAILED %s\n' % (done, len(pending), path, error))
+                    continue
+                entry = _stamp(path)
+                entry.update(operations=count, seconds=seconds)
+                checkpoint.write(json.dumps(entry) + '\n')
+                checkpoint.flush()
+                operations += count
+                elapsed = time.time() - started
+                sys.stderr.write('[%d/%d] %s: %d operations in %.1fs, total %d at %.0f ops/s\n'
+                                 % (done, len(pending), path, count, seconds,
+                                    operations, operations / max(elapsed, 1e-9)))
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - started
+    sys.stderr.write('%d operations in %.1fs (%.0f ops/s)\n'
+                     % (operations, elapsed, operations / max(elapsed, 1e-9)))
+    if failed:
+        sys.stderr.write('%d files failed and will be retried on the next run: %s\n'
+                         % (len(failed), ', '.join(failed)))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,9 +1,25 @@
-from flask import Flask,request
-import os,json
-import fault_prediction as analytic
+from flask import Flask,request,g
+import os,json,time
+from fault_engine import scorer
+from serving import pool, Overloaded
+import wire
+from fault_engine import metrics
 app = Flask(__name__)
 
 port = int(os.getenv("PORT",3000))
+scorer.warm_up()
+
+@app.before_request
+def start_timer():
+    g.started = time.time()
+
+@app.after_request
+def observe_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if 'started' in g:
+        metrics.request_seconds.observe(time.time() - g.started,route)
+    metrics.requests_total.inc(1,route,response.status_code)
+    return response
 
 @app.route('/',methods=['POST'])
 # def mapper(*args, **kwargs):
@@ -26,9 +42,112 @@ port = int(os.getenv("PORT",3000))
 #     return scores 
 
 def run_main():
-    data_dict = json.loads(request.data)
-    print data_dict
-    return json.dumps({'value':analytic.init_func(data_dict['data']['time_series']['time_stamp'],data_dict['data']['time_series']['current'],data_dict['data']['time_series']['pointMachineCode'])})
+    if request.mimetype == wire.CONTENT_TYPE:
+        try:
+            with metrics.stage('parse'):
+                operations = wire.decode(request.get_data())
+        except ValueError as e:
+            return json.dumps({'error':str(e)}),400
+        if len(operations[3]) != 1:
+            ## / scores one operation; several go to /batch
+            return json.dumps({'error':'expected 1 operation, got %d; use /batch for several' % len(operations[3])}),400
+        try:
+            return json.dumps({'value':pool.run(scorer.score_ragged,*operations)[0]})
+        except Overloaded as e:
+            return json.dumps({'error':str(e)}),503
+    with metrics.stage('parse'):
+        data_dict = json.loads(request.data)
+    app.logger.debug('payload %s',data_dict)
+    try:
+        return json.dumps({'value':pool.run(scorer.score,data_dict['data']['time_series']['time_stamp'],data_dict['data']['time_series']['current'],data_dict['data']['time_series']['pointMachineCode'],data_dict['data']['time_series'].get('stationCode'))})
+    except Overloaded as e:
+        return json.dumps({'error':str(e)}),503
     #return json.dumps({'fault_type':analytic.init_func(data_dict['data']['time_series']['time_stamp'],data_dict['data']['time_series']['current'],data_dict['data']['time_series']['pointMachineCode']),'operationId':data_dict['data']['time_series']['operationId']})
+
+@app.route('/batch',methods=['POST'])
+def run_batch():
+    if request.mimetype == wire.CONTENT_TYPE:
+        try:
+            with metrics.stage('parse'):
+                operations = wire.decode(request.get_data())
+        except ValueError as e:
+            return json.dumps({'error':str(e)}),400
+        try:
+            return json.dumps({'values':pool.run(scorer.score_ragged,*operations)})
+        except Overloaded as e:
+            return json.dumps({'error':str(e)}),503
+    with metrics.stage('parse'):
+        data_dict = json.loads(request.data)
+    try:
+        return json.dumps({'values':pool.run(scorer.score_many,data_dict['data']['time_series'])})
+    except Overloaded as e:
+        return json.dumps({'error':str(e)}),503
+
+@app.route('/stats',methods=['GET'])
+def run_stats():
+    return json.dumps(scorer.stats())
+
+@app.route('/rollup',methods=['GET'])
+def run_rollup():
+    ## ?buckets=24 for the last 24 buckets, ?by=station to sum over point machines
+    buckets = request.args.get('buckets',type=int)
+    if request.args.get('by') == 'station':
+        rows = scorer.rollup.by_station(buckets)
+    else:
+        rows = scorer.rollup.window(buckets)
+    return json.dumps({'rollup':rows,'stats':scorer.rollup.stats()})
+
+@app.route('/models',methods=['GET','POST'])
+def run_models():
+    ## POST ?version=2026.10.1 switches to that bundle: this worker at once,
+    ## the others within the registry's check_interval via bundles/CURRENT
+    if request.method == 'POST':
+        try:
+            scorer.registry.use(request.args.get('version',''))
+        except (IOError,OSError,KeyError,ValueError) as e:
+            return json.dumps({'error':str(e),'models':scorer.registry.stats()}),400
+    return json.dumps(scorer.registry.stats())
+
+## the only directories POST /shadow may load models from
+shadow_dirs = [scorer.registry.base_dir]
+if os.getenv('SHADOW_MODEL_DIR'):
+    shadow_dirs.append(os.path.abspath(os.getenv('SHADOW_MODEL_DIR')))
+
+@app.route('/shadow',methods=['GET','POST'])
+def run_shadow():
+    ## POST ?version=2026.10.2 (and/or ?model_dir= one of shadow_dirs) shadow-scores with
+    ## that model set in the worker that answers, ?enabled=0 stops; SHADOW_VERSION sets every worker
+    if request.method == 'POST':
+        if request.args.get('enabled') == '0':
+            scorer.stop_shadow()
+        else:
+            model_dir = request.args.get('model_dir') or None
+            if model_dir is not None and os.path.abspath(model_dir) not in shadow_dirs:
+                return json.dumps({'error':'model_dir must be MODEL_DIR or SHADOW_MODEL_DIR'}),400
+            try:
+                scorer.start_shadow(request.args.get('version') or None,model_dir,
+                                    request.args.get('workers',2,type=int),request.args.get('queue',256,type=int),
+                                    warm=True)
+            except (IOError,OSError,KeyError,ValueError) as e:
+                return json.dumps({'error':str(e)}),400
+    return json.dumps(scorer.stats().get('shadow',{'enabled':False}))
+
+@app.route('/metrics',methods=['GET'])
+def run_metrics():
+    return metrics.render(),200,{'Content-Type':'text/plain; version=0.0.4'}
+
+@app.route('/profiler',methods=['GET','POST'])
+def run_profiler():
+    ## POST ?enabled=1 starts sampling, ?enabled=0 stops it; GET returns collapsed stacks
+    if request.method == 'POST':
+        if request.args.get('enabled') == '1':
+            metrics.profiler.reset()
+            metrics.profiler.start()
+        else:
+            metrics.profiler.stop()
+        return json.dumps({'running':metrics.profiler.running,'samples':metrics.profiler.samples})
+    return metrics.profiler.report(),200,{'Content-Type':'text/plain'}
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    ## development server; production runs gunicorn -c gunicorn_conf.py run:app
+    app.run(host='0.0.0.0', port=port, threaded=True)
\ No newline at end of file
@@ -0,0 +1,95 @@
+
+# coding: utf-8
+
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from fault_engine.metrics import stage_seconds
+
+
+class Overloaded(Exception):
+    pass
+
+
+class _Job(object):
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.value = None
+        self.error = None
+        self.queued = time.time()
+        self.done = threading.Event()
+
+    def result(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise Overloaded('scoring did not finish within %s seconds' % timeout)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class ScoringPool(object):
+    """Bounded queue in front of a fixed set of scoring threads.
+
+    Request threads hand their predict call to the pool and wait, so the
+    number of concurrent xgboost calls per process stays at `workers` no
+    matter how many connections the front end holds open.  When `max_queue`
+    jobs are already waiting, submit() raises Overloaded instead of queueing
+    more, and run() raises it when a job takes longer than `timeout`.
+    Threads are started lazily in the process that first submits, so a pool
+    created before gunicorn forks works in every worker.
+    """
+
+    def __init__(self, workers=2, max_queue=64, timeout=30.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.max_queue)
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, args=(self._queue,))
+                thread.daemon = True
+                thread.start()
+            self._pid = os.getpid()
+
+    def _work(self, jobs):
+        while True:
+            job = jobs.get()
+            stage_seconds.observe(time.time() - job.queued, 'queue')
+            try:
+                job.value = job.fn(*job.args)
+            except Exception as e:
+                job.error = e
+            job.done.set()
+
+    def submit(self, fn, *args):
+        if self._pid != os.getpid():
+            self._start()
+        job = _Job(fn, args)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise Overloaded('%d scoring jobs already queued' % self.max_queue)
+        return job
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result(self.timeout)
+
+
+pool = ScoringPool(workers=int(os.getenv('SCORING_THREADS', 2)),
+                   max_queue=int(os.getenv('SCORING_QUEUE', 64)),
+                   timeout=float(os.getenv('SCORING_TIMEOUT', 30)))
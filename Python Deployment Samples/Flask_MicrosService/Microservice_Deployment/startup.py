@@ -0,0 +1,139 @@
+
+# coding: utf-8
+
+"""Cold-start report for the fault-prediction service.
+
+    python startup.py
+    python startup.py --module run --top 20
+
+Imports --module (fault_engine by default) with every first-time import
+timed, warms the model registry and scores one synthetic operation, then
+prints the slowest imports by their own time (without the imports they
+trigger), the import time per top-level package, the registry's
+load_seconds and the time to the first label.  It also lists which of the
+packages the hot path does not need (pandas, scipy, xgboost, sklearn) were
+loaded along the way; with a current model_forests.bin (see
+fault_engine.tree_engine buffer) none of them should be.  Run it in a fresh
+process, since anything already imported is not timed.
+"""
+
+import argparse
+import collections
+import sys
+import time
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+
+HEAVY = ('pandas', 'scipy', 'xgboost', 'sklearn')
+
+
+def _absolute(name, globals, level):
+    ## module name an import statement refers to, for relative imports too
+    if level <= 0 or not globals:
+        return name
+    package = globals.get('__package__')
+    if not package:
+        package = globals.get('__name__', '')
+        if '__path__' not in globals:
+            package = package.rpartition('.')[0]
+    if level > 1:
+        package = package.rsplit('.', level - 1)[0]
+    return '%s.%s' % (package, name) if name else package
+
+
+class ImportTimer(object):
+    """builtins.__import__ wrapper timing every module's first import.
+
+    Times are wall clock; self_seconds leaves out the nested imports a
+    module triggers while it runs, total_seconds includes them.
+    """
+
+    def __init__(self):
+        self.self_seconds = collections.defaultdict(float)
+        self.total_seconds = collections.defaultdict(float)
+        self._nested = []
+        self._import = None
+
+    def __call__(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = _absolute(name, globals, level)
+        if module in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+        self._nested.append(0.0)
+        started = time.time()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - started
+            nested = self._nested.pop()
+            self.self_seconds[module] += elapsed - nested
+            self.total_seconds[module] += elapsed
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def __enter__(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.__import__ = self._import
+
+    def by_package(self):
+        packages = collections.defaultdict(float)
+        for module, seconds in self.self_seconds.items():
+            packages[module.split('.')[0]] += seconds
+        return packages
+
+
+def run(module='fault_engine'):
+    started = time.time()
+    with ImportTimer() as timer:
+        __import__(module)
+    imported = time.time() - started
+    heavy_at_import = [name for name in HEAVY if name in sys.modules]
+
+    import synthetic
+    from fault_engine import registry, scorer
+    started = time.time()
+    scorer.warm_up()
+    warmed = time.time() - started
+    operation = synthetic.operations(1)[0]
+    scorer.score(operation['time_stamp'], operation['current'], operation['pointMachineCode'])
+    first_label = time.time() - started
+    return {'module': module, 'import_seconds': imported, 'warm_up_seconds': warmed,
+            'first_label_seconds': first_label, 'load_seconds': dict(registry.load_seconds),
+            'imports': timer, 'heavy_at_import': heavy_at_import,
+            'heavy_loaded': [name for name in HEAVY if name in sys.modules]}
+
+
+def report(result, top=15, out=sys.stdout):
+    timer = result['imports']
+    out.write('import %s: %.1f ms\n' % (result['module'], result['import_seconds'] * 1e3))
+    out.write('\nslowest imports (self ms, cumulative ms)\n')
+    slowest = sorted(timer.self_seconds.items(), key=lambda item: -item[1])[:top]
+    for module, seconds in slowest:
+        out.write('  %-40s %9.1f %9.1f\n' % (module, seconds * 1e3, timer.total_seconds[module] * 1e3))
+    out.write('\nper package (self ms)\n')
+    for package, seconds in sorted(timer.by_package().items(), key=lambda item: -item[1])[:top]:
+        out.write('  %-40s %9.1f\n' % (package, seconds * 1e3))
+    out.write('\nwarm_up: %.1f ms (%s)\n' % (result['warm_up_seconds'] * 1e3, ', '.join(
+        '%s %.1f ms' % (part, seconds * 1e3) for part, seconds in sorted(result['load_seconds'].items()))))
+    out.write('first label: %.1f ms after warm_up started\n' % (result['first_label_seconds'] * 1e3))
+    out.write('heavy packages at import: %s\n' % (', '.join(result['heavy_at_import']) or 'none'))
+    out.write('heavy packages after the first label: %s\n' % (', '.join(result['heavy_loaded']) or 'none'))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Report where cold-start time goes.')
+    parser.add_argument('--module', default='fault_engine', help='module to import, e.g. run')
+    parser.add_argument('--top', type=int, default=15, help='rows per table')
+    args = parser.parse_args(argv)
+    report(run(args.module), args.top)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
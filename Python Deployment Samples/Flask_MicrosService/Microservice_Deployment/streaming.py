@@ -0,0 +1,174 @@
+
+# coding: utf-8
+
+"""Fault labels for live current telemetry, one per completed operation.
+
+    python streaming.py --tail current.log
+    python streaming.py --connect gateway:9000
+    python streaming.py < current.log
+
+Input lines are 'pointMachineCode,time_stamp,current[,stationCode]', in time
+order per point machine.  Every operation that closes is written to stdout
+as one JSON object.
+"""
+
+import argparse
+import json
+import socket
+import sys
+import time
+
+import numpy as np
+
+from fault_engine.features import OnlineFeatures
+
+
+class OperationSegmenter(object):
+    """Cuts one point machine's current stream into operations.
+
+    An operation opens on the first sample above start_threshold and closes
+    once end_samples consecutive samples have been at or below end_threshold
+    (those samples belong to it), or when it has lasted max_duration time
+    stamp units.  Samples go straight into an OnlineFeatures accumulator;
+    nothing is buffered.
+    """
+
+    def __init__(self, start_threshold=1.0, end_threshold=0.5, end_samples=3, max_duration=60000):
+        self.start_threshold = start_threshold
+        self.end_threshold = end_threshold
+        self.end_samples = end_samples
+        self.max_duration = max_duration
+        self.operation = None
+        self.start = None
+        self.quiet = 0
+
+    def push(self, timestamp, value):
+        ## the accumulator of the operation this sample closed, else None
+        if self.operation is None:
+            if not value > self.start_threshold:
+                return None
+            self.operation = OnlineFeatures()
+            self.start = timestamp
+            self.quiet = 0
+        self.operation.update(timestamp, value)
+        self.quiet = self.quiet + 1 if value <= self.end_threshold else 0
+        if self.quiet >= self.end_samples or timestamp - self.start >= self.max_duration:
+            closed, self.operation = self.operation, None
+            return closed
+        return None
+
+
+def parse_line(line):
+    fields = line.strip().split(',')
+    if len(fields) < 3:
+        raise ValueError('expected pointMachineCode,time_stamp,current[,stationCode]: %r' % line)
+    station = fields[3] if len(fields) > 3 and fields[3] else None
+    return fields[0], int(fields[1]), float(fields[2]), station
+
+
+class StreamScorer(object):
+    """One OperationSegmenter per (station, point machine), scored on close.
+
+    label takes (feature rows, codes, stations) and returns one label per
+    row; it defaults to scorer.label_features.
+    """
+
+    def __init__(self, label=None, **segmenter_options):
+        if label is None:
+            from fault_engine import scorer
+            label = scorer.label_features
+        self.label = label
+        self.segmenter_options = segmenter_options
+        self.segmenters = {}
+        self.malformed = 0
+
+    def push(self, PM_Code, timestamp, value, STATION=None):
+        key = (STATION, PM_Code)
+        segmenter = self.segmenters.get(key)
+        if segmenter is None:
+            segmenter = self.segmenters[key] = OperationSegmenter(**self.segmenter_options)
+        operation = segmenter.push(timestamp, value)
+        if operation is None:
+            return None
+        label = self.label(operation.features()[np.newaxis], [PM_Code], [STATION])[0]
+        return {'pointMachineCode': PM_Code, 'stationCode': STATION, 'start': operation.min_time,
+                'end': operation.max_time, 'points_captured': operation.n, 'value': label}
+
+    def run(self, lines):
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                PM_Code, timestamp, value, STATION = parse_line(line)
+            except ValueError:
+                self.malformed += 1
+                continue
+            result = self.push(PM_Code, timestamp, value, STATION)
+            if result is not None:
+                yield result
+
+
+def tail_lines(path, from_start=False, poll=0.2):
+    ## follow a growing file like tail -f, yielding complete lines only
+    with open(path) as f:
+        if not from_start:
+            f.seek(0, 2)
+        partial = ''
+        while True:
+            chunk = f.readline()
+            if not chunk:
+                time.sleep(poll)
+                continue
+            partial += chunk
+            if partial.endswith('\n'):
+                yield partial
+                partial = ''
+
+
+def socket_lines(address):
+    host, port = address.rsplit(':', 1)
+    connection = socket.create_connection((host, int(port)))
+    try:
+        for line in connection.makefile('r'):
+            yield line
+    finally:
+        connection.close()
+
+
+def queue_lines(source):
+    ## local stand-in for a message queue: lines until a None is put
+    while True:
+        line = source.get()
+        if line is None:
+            return
+        yield line
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Score operations from a live current stream.')
+    parser.add_argument('--tail', help='follow this file')
+    parser.add_argument('--from-start', action='store_true', help='with --tail, read the existing lines too')
+    parser.add_argument('--connect', help='read lines from host:port')
+    parser.add_argument('--start-threshold', type=float, default=1.0)
+    parser.add_argument('--end-threshold', type=float, default=0.5)
+    parser.add_argument('--end-samples', type=int, default=3)
+    parser.add_argument('--max-duration', type=int, default=60000)
+    args = parser.parse_args(argv)
+
+    from fault_engine import scorer
+    scorer.warm_up()
+    scorer = StreamScorer(start_threshold=args.start_threshold, end_threshold=args.end_threshold,
+                          end_samples=args.end_samples, max_duration=args.max_duration)
+    if args.tail:
+        lines = tail_lines(args.tail, args.from_start)
+    elif args.connect:
+        lines = socket_lines(args.connect)
+    else:
+        lines = sys.stdin
+    for result in scorer.run(lines):
+        sys.stdout.write(json.dumps(result) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
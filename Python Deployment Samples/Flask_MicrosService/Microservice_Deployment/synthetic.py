@@ -0,0 +1,58 @@
+
+# coding: utf-8
+
+"""Synthetic point-machine current waveforms for benchmarks and load tests.
+
+Every shape starts with an inrush spike and settles on a running current:
+
+    normal       clean decay to about 3 A, drop-off at the end
+    obstruction  current climbs instead of settling and the throw runs long
+    brush_noise  normal shape under heavy sample-to-sample noise
+    peak         normal shape with an inrush well above the peak cutoffs
+"""
+
+import numpy as np
+
+
+SHAPES = ('normal', 'obstruction', 'brush_noise', 'peak')
+LENGTHS = (50, 200, 800)
+## codes present in Threshold_limits_pointmachine.csv
+CODES = ('PT42_A', 'PT44_A', 'PT11_A', 'PT20_B')
+START = 1500000000000
+
+
+def waveform(shape, n, rng, start=START):
+    """(TIMESTAMP, VALUE) of one n-sample operation of the given shape."""
+    t = np.arange(n, dtype=np.float64)
+    inrush = 9.0 * np.exp(-t / 8.0)
+    running = np.where(t < 0.9 * n, 3.0, 0.3)
+    noise = 0.05
+    step = 10
+    if shape == 'obstruction':
+        running = running + 4.0 * t / n
+        step = 25
+    elif shape == 'brush_noise':
+        noise = 0.8
+    elif shape == 'peak':
+        inrush = 2.5 * inrush
+    elif shape != 'normal':
+        raise ValueError('unknown shape %r, expected one of %s' % (shape, ', '.join(SHAPES)))
+    VALUE = running + inrush + rng.randn(n) * noise
+    TIMESTAMP = start + np.cumsum(rng.randint(step // 2, step * 3 // 2, n)).astype(np.int64)
+    return TIMESTAMP, VALUE
+
+
+def operations(count, shapes=SHAPES, lengths=LENGTHS, codes=CODES, seed=0):
+    """count data.time_series dicts cycling through shapes, lengths and codes.
+
+    The same arguments always give the same operations.
+    """
+    rng = np.random.RandomState(seed)
+    result = []
+    for i in range(count):
+        shape = shapes[i % len(shapes)]
+        n = lengths[(i // len(shapes)) % len(lengths)]
+        TIMESTAMP, VALUE = waveform(shape, n, rng, START + i * 60000)
+        result.append({'operationId': str(i), 'pointMachineCode': codes[i % len(codes)],
+                       'time_stamp': TIMESTAMP.tolist(), 'current': VALUE.tolist(), 'shape': shape})
+    return result
@@ -0,0 +1,136 @@
+
+# coding: utf-8
+
+"""OnlineFeatures, fed per sample, per chunk or merged, must match the
+pandas features the models were trained on.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+import numpy as np
+
+try:
+    from fault_engine import legacy
+except ImportError:
+    legacy = None
+
+import synthetic
+from fault_engine.features import (CURRENT_GRADIENT, DURATION, N_FEATURES, PEAK_CURRENT, POINTS_CAPTURED,
+                                   SLOPE, TOT_MAX, TOT_MIN, OnlineFeatures, operation_features)
+
+
+## relative tolerance of the gradient; every other feature must be equal
+GRADIENT_RTOL = 1e-9
+EXACT = [POINTS_CAPTURED, DURATION, TOT_MAX, TOT_MIN, PEAK_CURRENT]
+
+
+def waveforms():
+    ## synthetic shapes of every length, plus plateaus, steps and tiny operations
+    result = [(np.asarray(operation['time_stamp']), np.asarray(operation['current']))
+              for operation in synthetic.operations(12, seed=7)]
+    rng = np.random.RandomState(3)
+    plateau = np.round(rng.randn(300) * 2) / 2
+    result.append((np.arange(300, dtype=np.int64) * 10, plateau))
+    result.append((np.arange(40, dtype=np.int64), np.repeat([1.0, 3.0, 3.0, 2.0, 2.0, 5.0, 1.0, 1.0], 5)))
+    for n in (1, 2, 3):
+        result.append((np.arange(n, dtype=np.int64) + 7, np.array([2.0, 1.0, 4.0][:n])))
+    return result
+
+
+def legacy_features(TIMESTAMP, VALUE):
+    ## operation_features layout from the original pandas code
+    frame = legacy.create_newstring(TIMESTAMP, VALUE, 'PT42_A')
+    obs = legacy.create_features_obs(frame).iloc[0]
+    cb = legacy.create_features_cb(frame).iloc[0]
+    features = np.empty(N_FEATURES)
+    features[POINTS_CAPTURED] = obs['points_captured']
+    features[CURRENT_GRADIENT] = obs['current_gradient']
+    features[DURATION] = obs['Duration']
+    features[TOT_MAX] = cb['tot_max']
+    features[TOT_MIN] = cb['tot_min']
+    features[SLOPE] = cb['slope']
+    features[PEAK_CURRENT] = np.max(VALUE)
+    return features
+
+
+def per_sample(TIMESTAMP, VALUE):
+    online = OnlineFeatures()
+    for timestamp, value in zip(TIMESTAMP, VALUE):
+        online.update(timestamp, value)
+    return online.features()
+
+
+def chunked(TIMESTAMP, VALUE, bounds):
+    online = OnlineFeatures()
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        online.update_many(TIMESTAMP[start:stop], VALUE[start:stop])
+    return online.features()
+
+
+def merged(TIMESTAMP, VALUE, bounds):
+    ## chunks reduced independently, then merged pairwise from the right
+    parts = [OnlineFeatures.from_arrays(TIMESTAMP[start:stop], VALUE[start:stop])
+             for start, stop in zip(bounds[:-1], bounds[1:])]
+    while len(parts) > 1:
+        parts[-2] = parts[-2].merge(parts[-1])
+        parts.pop()
+    return parts[0].features()
+
+
+def chunk_bounds(n, rng):
+    ## seams anywhere, including chunks of one and two samples
+    if n < 2:
+        return [0, n]
+    cuts = set(rng.randint(1, n, size=6).tolist()) | set([1, min(2, n - 1)])
+    return [0] + sorted(cuts) + [n]
+
+
+class OnlineFeaturesTest(unittest.TestCase):
+
+    def assertSameFeatures(self, actual, expected):
+        np.testing.assert_array_equal(actual[EXACT], expected[EXACT])
+        for column in (CURRENT_GRADIENT, SLOPE):
+            if np.isnan(expected[column]):
+                self.assertTrue(np.isnan(actual[column]))
+            else:
+                self.assertTrue(np.isclose(actual[column], expected[column], rtol=GRADIENT_RTOL, atol=0),
+                                '%r != %r' % (actual[column], expected[column]))
+
+    def test_per_sample(self):
+        for TIMESTAMP, VALUE in waveforms():
+            self.assertSameFeatures(per_sample(TIMESTAMP, VALUE), operation_features(TIMESTAMP, VALUE))
+
+    def test_chunks_and_merge(self):
+        rng = np.random.RandomState(0)
+        for TIMESTAMP, VALUE in waveforms():
+            expected = operation_features(TIMESTAMP, VALUE)
+            for _ in range(5):
+                bounds = chunk_bounds(len(VALUE), rng)
+                self.assertSameFeatures(chunked(TIMESTAMP, VALUE, bounds), expected)
+                self.assertSameFeatures(merged(TIMESTAMP, VALUE, bounds), expected)
+
+    def test_merge_empty(self):
+        TIMESTAMP, VALUE = waveforms()[0]
+        expected = operation_features(TIMESTAMP, VALUE)
+        self.assertSameFeatures(OnlineFeatures().merge(OnlineFeatures.from_arrays(TIMESTAMP, VALUE)).features(),
+                                expected)
+        self.assertSameFeatures(OnlineFeatures.from_arrays(TIMESTAMP, VALUE).merge(OnlineFeatures()).features(),
+                                expected)
+
+    @unittest.skipIf(legacy is None, 'pandas or scipy is not installed')
+    def test_matches_pandas(self):
+        rng = np.random.RandomState(1)
+        for TIMESTAMP, VALUE in waveforms():
+            if len(VALUE) < 2:
+                ## np.corrcoef of a single sample warns and gives NaN either way
+                continue
+            expected = legacy_features(TIMESTAMP, VALUE)
+            self.assertSameFeatures(operation_features(TIMESTAMP, VALUE), expected)
+            self.assertSameFeatures(per_sample(TIMESTAMP, VALUE), expected)
+            self.assertSameFeatures(merged(TIMESTAMP, VALUE, chunk_bounds(len(VALUE), rng)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+
+# coding: utf-8
+
+"""The compiled forests must reproduce Booster.predict bit for bit.
+
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import xgboost as xgb
+except ImportError:
+    xgb = None
+
+from fault_engine.features import FEATURES_OBS
+from fault_engine.tree_engine import (attach_buffer, boundary_matrix, export_booster, load_forest,
+                                      mismatches, save_forest, write_buffer)
+
+
+def train_booster(seed=0, rows=600, num_class=3, rounds=12):
+    ## small multi:softmax booster on rounded features, so splits land on ties
+    rng = np.random.RandomState(seed)
+    X = np.round(rng.randn(rows, len(FEATURES_OBS)) * 10).astype(np.float32)
+    X[rng.rand(*X.shape) < 0.05] = np.nan
+    filled = np.nan_to_num(X)
+    score = filled[:, 0] + 0.5 * filled[:, 1] - 0.3 * filled[:, 2] + rng.randn(rows) * 5
+    y = np.digitize(score, np.percentile(score, np.linspace(0, 100, num_class + 1)[1:-1]))
+    d_train = xgb.DMatrix(X, label=y, feature_names=FEATURES_OBS)
+    params = {'objective': 'multi:softmax', 'num_class': num_class, 'max_depth': 4, 'eta': 0.3,
+              'base_score': 0.5, 'verbosity': 0}
+    return xgb.train(params, d_train, rounds), X
+
+
+@unittest.skipIf(xgb is None, 'xgboost is not installed')
+class CompiledForestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.booster, self.X = train_booster()
+        self.forest = export_booster(self.booster)
+
+    def assertMatches(self, forest, X):
+        self.assertEqual(mismatches(self.booster, forest, X), {'class': 0, 'margin': 0, 'walk': 0})
+
+    def test_training_rows(self):
+        self.assertMatches(self.forest, self.X)
+
+    def test_split_boundaries(self):
+        ## exact ties, values a hair either side of a threshold, and NaNs
+        self.assertMatches(self.forest, boundary_matrix(self.forest, 4096, seed=1))
+
+    def test_single_row(self):
+        self.assertMatches(self.forest, self.X[:1])
+
+    def test_without_table(self):
+        forest = export_booster(self.booster)
+        forest._table = None
+        self.assertMatches(forest, boundary_matrix(forest, 1024, seed=2))
+
+    def test_saved_and_buffered(self):
+        directory = tempfile.mkdtemp()
+        try:
+            save_forest(self.forest, os.path.join(directory, 'model.npz'))
+            write_buffer({'model': self.forest}, os.path.join(directory, 'model_forests.bin'))
+            X = boundary_matrix(self.forest, 1024, seed=3)
+            self.assertMatches(load_forest(os.path.join(directory, 'model.npz')), X)
+            self.assertMatches(attach_buffer(os.path.join(directory, 'model_forests.bin'))['model'], X)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
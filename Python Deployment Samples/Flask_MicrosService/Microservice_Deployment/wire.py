@@ -0,0 +1,82 @@
+
+# coding: utf-8
+
+"""Binary payload for time-series scoring requests.
+
+POST bodies with Content-Type application/x-pm-timeseries use this layout,
+all little-endian and 8-byte aligned, so the arrays are read with
+np.frombuffer straight out of the request body:
+
+    24 bytes  header: b'PMTS', uint16 version, uint16 flags (0),
+              uint32 operation count k, uint64 sample count n, 4 pad bytes
+    int64[k + 1]  offsets: operation i is samples offsets[i]:offsets[i + 1]
+    int64[n]      time_stamp
+    float64[n]    current
+    utf-8 text    k lines 'pointMachineCode' or 'pointMachineCode<TAB>stationCode'
+"""
+
+import struct
+
+import numpy as np
+
+
+CONTENT_TYPE = 'application/x-pm-timeseries'
+MAGIC = b'PMTS'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIQ4x')
+
+
+def encode(operations):
+    ## list of data.time_series dicts -> request body
+    lengths = [len(operation['current']) for operation in operations]
+    offsets = np.zeros(len(operations) + 1, dtype='<i8')
+    np.cumsum(lengths, out=offsets[1:])
+    TIMESTAMP = np.zeros(offsets[-1], dtype='<i8')
+    VALUE = np.zeros(offsets[-1], dtype='<f8')
+    for i, operation in enumerate(operations):
+        TIMESTAMP[offsets[i]:offsets[i + 1]] = operation['time_stamp']
+        VALUE[offsets[i]:offsets[i + 1]] = operation['current']
+    lines = []
+    for operation in operations:
+        if operation.get('stationCode'):
+            lines.append(u'%s\t%s' % (operation['pointMachineCode'], operation['stationCode']))
+        else:
+            lines.append(u'%s' % operation['pointMachineCode'])
+    return b''.join([HEADER.pack(MAGIC, VERSION, 0, len(operations), int(offsets[-1])),
+                     offsets.tobytes(), TIMESTAMP.tobytes(), VALUE.tobytes(),
+                     u'\n'.join(lines).encode('utf-8')])
+
+
+def decode(body):
+    """Request body -> (TIMESTAMP, VALUE, offsets, codes, stations).
+
+    The three arrays are read-only views on body, laid out the way
+    features.batch_features expects.  stations holds None where the line
+    had no station code.
+    """
+    if len(body) < HEADER.size:
+        raise ValueError('payload shorter than its header')
+    magic, version, flags, k, n = HEADER.unpack_from(body)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a version %d %s payload' % (VERSION, CONTENT_TYPE))
+    position = HEADER.size
+    text_start = position + 8 * (k + 1) + 16 * n
+    if len(body) < text_start:
+        raise ValueError('payload truncated: %d operations, %d samples' % (k, n))
+    offsets = np.frombuffer(body, dtype='<i8', count=k + 1, offset=position)
+    position += 8 * (k + 1)
+    TIMESTAMP = np.frombuffer(body, dtype='<i8', count=n, offset=position)
+    position += 8 * n
+    VALUE = np.frombuffer(body, dtype='<f8', count=n, offset=position)
+    if offsets[0] != 0 or offsets[-1] != n or np.any(np.diff(offsets) < 1):
+        raise ValueError('offsets do not cover the samples in order')
+    lines = body[text_start:].decode('utf-8').split(u'\n') if k else []
+    if len(lines) != k:
+        raise ValueError('expected %d point machine codes, got %d' % (k, len(lines)))
+    codes = []
+    stations = []
+    for line in lines:
+        fields = line.split(u'\t')
+        codes.append(fields[0])
+        stations.append(fields[1] if len(fields) > 1 else None)
+    return TIMESTAMP, VALUE, offsets, codes, stations